@@ -1,9 +1,13 @@
 """Application configuration and database setup"""
 import os
 import logging
+import httpx
+from functools import lru_cache
+from datetime import timezone
+from typing import Final
 from pathlib import Path
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, UpdateOne
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -17,9 +21,118 @@ logger = logging.getLogger(__name__)
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware so BSON dates come back as UTC-aware datetimes; the pool keeps
+# warm connections around so the first requests don't pay the connect cost.
+# PyMongo's native asyncio client awaits socket I/O directly instead of
+# dispatching every operation to a thread pool as Motor does
+client = AsyncMongoClient(
+    mongo_url,
+    tz_aware=True,
+    tzinfo=timezone.utc,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 200)),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 50)),
+    # Fail fast with an error instead of queueing indefinitely when the pool is exhausted
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    serverSelectionTimeoutMS=3000,
+    retryWrites=True,
+    # zstd where the server supports it (4.2+), stdlib zlib as the fallback
+    compressors="zstd,zlib",
+    zlibCompressionLevel=-1
+)
 db = client[os.environ['DB_NAME']]
 
+# Shared HTTP client for outbound calls (Google, Emergent Auth, webhooks) so
+# connections and TLS sessions are reused instead of re-established per request
+http_client = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64)
+)
+
+
+async def _create_index(collection, keys, **kwargs):
+    """Create one index, logging failures (e.g. duplicates blocking a unique index)"""
+    try:
+        await collection.create_index(keys, **kwargs)
+    except Exception as e:
+        logger.warning(f"Index creation failed on {collection.name} {keys}: {e}")
+
+
+async def ensure_indexes():
+    """Create (or verify) the indexes backing the hot query paths; each index is
+    created independently so one conflict doesn't skip the rest"""
+    await _create_index(db.users, "email", unique=True)
+    await _create_index(db.users, "user_id", unique=True)
+    # Active agent listing: equality on role/is_active, in insertion (_id) order
+    try:
+        await db.users.drop_index("role_1_is_active_1_user_id_1")
+    except Exception:
+        pass
+    await _create_index(db.users, [("role", 1), ("is_active", 1), ("_id", 1)])
+    await _create_index(db.leads, "lead_id", unique=True)
+    await _create_index(db.leads, "email")
+    await _create_index(db.leads, "assigned_agent_id")
+    await _create_index(db.leads, "status")
+    await _create_index(db.students, "student_id", unique=True)
+    await _create_index(db.students, "email")
+    await _create_index(db.students, "institutional_email", unique=True, sparse=True)
+    await _create_index(db.students, [("created_at", -1)])
+    await _create_index(db.students, [("student_id", 1), ("documents.document_id", 1)])
+    await _create_index(db.teachers, "teacher_id", unique=True)
+    await _create_index(db.teachers, "email", unique=True)
+    await _create_index(db.careers_full, "career_id", unique=True)
+    # appointment_id only exists on legacy appointments (new ones are keyed by _id),
+    # so its unique index has to be sparse; replace the old non-sparse one
+    try:
+        appointment_indexes = await db.appointments.index_information()
+        if not appointment_indexes.get("appointment_id_1", {"sparse": True}).get("sparse"):
+            await db.appointments.drop_index("appointment_id_1")
+    except Exception as e:
+        logger.warning(f"Could not replace appointments.appointment_id_1: {e}")
+    await _create_index(db.appointments, "appointment_id", unique=True, sparse=True)
+    await _create_index(db.appointments, "scheduled_at")
+    # Serves get_appointments' {agent_id, status} filter with an index-provided sort
+    await _create_index(db.appointments, [("agent_id", 1), ("status", 1), ("scheduled_at", 1)])
+    await _create_index(db.custom_fields, "field_id", unique=True)
+    await _create_index(db.custom_fields, "order")
+    await _create_index(db.change_requests, "request_id", unique=True)
+    # Change request / audit log listings: optional filters, newest first
+    await _create_index(db.change_requests, [("status", 1), ("created_at", -1)])
+    await _create_index(db.change_requests, [("created_at", -1)])
+    await _create_index(db.audit_logs, "timestamp")
+    await _create_index(db.audit_logs, "entity_id")
+    await _create_index(db.audit_logs, [("entity_type", 1), ("entity_id", 1), ("timestamp", -1)])
+    # One-time tokens expire server-side: reset tokens at their expires_at,
+    # OAuth states an hour after they are issued
+    await _create_index(db.password_resets, "email", unique=True)
+    await _create_index(db.password_resets, "expires_at", expireAfterSeconds=0)
+    await _create_index(db.oauth_states, "created_at", expireAfterSeconds=3600)
+    # Token lookups; sparse because rows written before tokens were hashed lack the field
+    await _create_index(db.password_resets, "token_hash", unique=True, sparse=True)
+    await _create_index(db.oauth_states, "state_hash", unique=True, sparse=True)
+    await _create_index(db.user_sessions, "session_token", unique=True)
+    await _create_index(db.user_sessions, "expires_at", expireAfterSeconds=0)
+    # Lead list filters/sort (newest first) and the dashboard breakdowns
+    await _create_index(db.leads, [("assigned_agent_id", 1), ("created_at", -1)])
+    await _create_index(db.leads, [("source", 1)])
+    await _create_index(db.leads, [("career_interest", 1)])
+    await _create_index(db.leads, [("created_at", -1)])
+    # Lead search box: anchored prefix regexes on lower-cased copies (the old text
+    # index split emails on "@"/"." and could not match partial names or phones)
+    try:
+        await db.leads.drop_index("full_name_text_email_text_phone_text")
+    except Exception:
+        pass
+    await _create_index(db.leads, "full_name_lc")
+    await _create_index(db.leads, "email_lc")
+    await _create_index(db.leads, "phone")
+    await _create_index(db.appointments, [("agent_id", 1), ("scheduled_at", 1)])
+    await _create_index(db.students, "lead_id")
+    # One conversation document per lead
+    await _create_index(db.conversations, "lead_id", unique=True)
+    await _create_index(db.dashboard_snapshots, "scope", unique=True)
+    await _create_index(db.webhooks, "webhook_id", unique=True)
+    await _create_index(db.notification_settings, "settings_id", unique=True)
+
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'leadflow-pro-secret-key-2024')
 JWT_ALGORITHM = "HS256"
@@ -39,29 +152,83 @@ GOOGLE_CALENDAR_SCOPES = ["https://www.googleapis.com/auth/calendar", "https://w
 RESEND_API_KEY = os.environ.get('RESEND_API_KEY')
 SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'onboarding@resend.dev')
 
-# Initialize Twilio client
-twilio_client = None
-if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+# The Twilio client is built on first use (and the storage folder created at
+# startup) so importing config stays limited to reading environment variables
+@lru_cache(maxsize=1)
+def get_twilio_client():
+    """Return the shared Twilio client, or None if it isn't configured"""
+    if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN):
+        return None
     try:
         from twilio.rest import Client as TwilioClient
         twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
         logger.info("Twilio client initialized successfully")
+        return twilio_client
     except Exception as e:
         logger.error(f"Failed to initialize Twilio client: {e}")
+        return None
 
-# Initialize Resend
-if RESEND_API_KEY:
-    import resend
-    resend.api_key = RESEND_API_KEY
-    logger.info("Resend email client configured")
-
-# Constants
-USER_ROLES = ["admin", "gerente", "supervisor", "agente", "maestro"]
-LEAD_SOURCES = ["facebook", "instagram", "tiktok", "manual", "webhook"]
-LEAD_STATUSES = ["etapa_1_informacion", "etapa_2_contacto", "etapa_3_documentacion", "etapa_4_inscrito"]
-DEFAULT_CAREERS = ["Ingeniería", "Medicina", "Derecho", "Administración", "Contabilidad", "Psicología", "Diseño", "Marketing", "Otra"]
-NOTIFICATION_EVENTS = ["lead.created", "lead.updated", "appointment.created", "appointment.reminder"]
+# Constants (immutable tuples: order matters for the dropdown endpoints; the
+# matching Literal types in models validate request payloads)
+USER_ROLES: Final = ("admin", "gerente", "supervisor", "agente", "maestro")
+LEAD_SOURCES: Final = ("facebook", "instagram", "tiktok", "manual", "webhook")
+LEAD_STATUSES: Final = ("nuevo", "etapa_1_informacion", "etapa_2_contacto", "etapa_3_documentacion", "etapa_4_inscrito")
+DEFAULT_CAREERS: Final = ("Ingeniería", "Medicina", "Derecho", "Administración", "Contabilidad", "Psicología", "Diseño", "Marketing", "Otra")
+NOTIFICATION_EVENTS: Final = ("lead.created", "lead.updated", "appointment.created", "appointment.reminder")
 
 # Paths
 STUDENT_DOCUMENTS_PATH = Path("/app/student_documents")
-STUDENT_DOCUMENTS_PATH.mkdir(exist_ok=True)
+
+
+# Timestamps older versions stored as ISO strings; migrate_legacy_dates converts them
+LEGACY_DATE_FIELDS: Final = (
+    ("users", ("created_at", "updated_at")),
+    ("teachers", ("created_at", "updated_at")),
+    ("webhooks", ("created_at",)),
+    ("notification_settings", ("updated_at",)),
+    ("leads", ("created_at", "updated_at")),
+    ("conversations", ("created_at", "updated_at")),
+    ("students", ("created_at", "updated_at")),
+    ("careers_full", ("created_at", "updated_at")),
+    ("appointments", ("scheduled_at", "created_at", "updated_at")),
+    # TTL indexes ignore non-date values, so string rows here would never expire
+    ("user_sessions", ("expires_at",)),
+    ("password_resets", ("expires_at",)),
+    ("oauth_states", ("created_at",)),
+)
+
+
+async def migrate_legacy_dates():
+    """Convert leftover ISO-string timestamps to BSON dates (idempotent, run at startup)"""
+    for collection, fields in LEGACY_DATE_FIELDS:
+        for field in fields:
+            # Unparseable values are left as they are rather than failing the whole update
+            await db[collection].update_many(
+                {field: {"$type": "string"}},
+                [{"$set": {field: {"$convert": {"input": f"${field}", "to": "date", "onError": f"${field}"}}}}]
+            )
+
+
+async def backfill_lead_search_fields():
+    """Add full_name_lc/email_lc to leads written before they existed (idempotent, run at startup)"""
+    cursor = db.leads.find(
+        {"$or": [{"full_name_lc": {"$exists": False}}, {"email_lc": {"$exists": False}}]},
+        {"_id": 1, "full_name": 1, "email": 1}
+    )
+    batch = []
+    async for lead in cursor:
+        # Python's lower() (unlike $toLower) also folds accented capitals
+        batch.append(UpdateOne({"_id": lead["_id"]}, {"$set": {
+            "full_name_lc": (lead.get("full_name") or "").lower(),
+            "email_lc": (lead.get("email") or "").lower()
+        }}))
+        if len(batch) == 500:
+            await db.leads.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.leads.bulk_write(batch, ordered=False)
+
+
+def ensure_storage_dirs():
+    """Create the folders used for uploaded files"""
+    STUDENT_DOCUMENTS_PATH.mkdir(exist_ok=True)
@@ -1,4 +1,5 @@
 """Pydantic models for the application"""
+from .base import BaseResponse
 from .users import (
     UserBase, UserCreate, UserLogin, UserUpdate, UserResponse, TokenResponse,
     ForgotPasswordRequest, ResetPasswordRequest, AdminResetPasswordRequest
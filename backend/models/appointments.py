@@ -1,7 +1,8 @@
 """Appointment-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
+from .base import BaseResponse
 
 
 class AppointmentCreate(BaseModel):
@@ -19,8 +20,7 @@ class AppointmentUpdate(BaseModel):
     status: Optional[str] = None
 
 
-class AppointmentResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class AppointmentResponse(BaseResponse):
     appointment_id: str
     lead_id: str
     lead_name: Optional[str] = None
@@ -0,0 +1,8 @@
+"""Shared base for response models"""
+from pydantic import BaseModel, ConfigDict
+
+
+class BaseResponse(BaseModel):
+    # Responses are built from Mongo documents, so unknown keys are dropped.
+    # defer_build postpones core-schema construction until a model is first used.
+    model_config = ConfigDict(extra="ignore", defer_build=True)
@@ -1,6 +1,8 @@
 """Career-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
+from .base import BaseResponse
 
 
 class CareerScheduleItem(BaseModel):
@@ -29,12 +31,11 @@ class CareerUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 
-class CareerResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class CareerResponse(BaseResponse):
     career_id: str
     name: str
     description: Optional[str] = None
     modality: str = "presencial"
     schedules: List[dict] = []
     is_active: bool = True
-    created_at: str
+    created_at: datetime
@@ -1,5 +1,7 @@
 """Dashboard-related Pydantic models"""
 from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
 
 
 class DashboardStats(BaseModel):
@@ -11,3 +13,4 @@ class DashboardStats(BaseModel):
     conversion_rate: float
     new_leads_today: int
     appointments_today: int
+    refreshed_at: Optional[datetime] = None
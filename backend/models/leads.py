@@ -1,7 +1,12 @@
 """Lead-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict, EmailStr, Field
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Literal, Optional
 from datetime import datetime, timezone
+from .base import BaseResponse
+
+# Mirror config.LEAD_SOURCES / config.LEAD_STATUSES
+LeadSource = Literal["facebook", "instagram", "tiktok", "manual", "webhook"]
+LeadStatus = Literal["nuevo", "etapa_1_informacion", "etapa_2_contacto", "etapa_3_documentacion", "etapa_4_inscrito"]
 
 
 class LeadBase(BaseModel):
@@ -14,6 +19,7 @@ class LeadBase(BaseModel):
 
 
 class LeadCreate(LeadBase):
+    source: LeadSource = "manual"
     assigned_agent_id: Optional[str] = None
 
 
@@ -22,13 +28,12 @@ class LeadUpdate(BaseModel):
     email: Optional[EmailStr] = None
     phone: Optional[str] = None
     career_interest: Optional[str] = None
-    status: Optional[str] = None
+    status: Optional[LeadStatus] = None
     assigned_agent_id: Optional[str] = None
     notes: Optional[str] = None
 
 
-class LeadResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class LeadResponse(BaseResponse):
     lead_id: str
     full_name: str
     email: str
@@ -57,8 +62,7 @@ class ConversationCreate(BaseModel):
     sender: str = "agent"
 
 
-class ConversationResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class ConversationResponse(BaseResponse):
     conversation_id: str
     lead_id: str
     messages: List[ConversationMessage]
@@ -1,13 +1,15 @@
 """Student-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict, EmailStr
+from pydantic import BaseModel, EmailStr
 from typing import List, Optional, Any
+from datetime import datetime
+from .base import BaseResponse
 
 
 class StudentDocument(BaseModel):
     document_id: str
     name: str  # INE, Certificado, Foto, etc.
     filename: str
-    uploaded_at: str
+    uploaded_at: datetime
 
 
 class AttendanceRecord(BaseModel):
@@ -37,8 +39,7 @@ class StudentUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 
-class StudentResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class StudentResponse(BaseResponse):
     student_id: str
     full_name: str
     email: str
@@ -51,7 +52,7 @@ class StudentResponse(BaseModel):
     attendance: List[dict] = []
     custom_fields: dict = {}
     is_active: bool = True
-    created_at: str
+    created_at: datetime
 
 
 class ConvertLeadToStudent(BaseModel):
@@ -90,8 +91,8 @@ class ChangeRequest(BaseModel):
     status: str = "pending"  # pending, approved, rejected
     approved_by_id: Optional[str] = None
     approved_by_name: Optional[str] = None
-    created_at: str
-    resolved_at: Optional[str] = None
+    created_at: datetime
+    resolved_at: Optional[datetime] = None
 
 
 # Audit Log Models
@@ -108,5 +109,5 @@ class AuditLogEntry(BaseModel):
     performed_by_role: str
     authorized_by_id: Optional[str] = None
     authorized_by_name: Optional[str] = None
-    timestamp: str
+    timestamp: datetime
     ip_address: Optional[str] = None
@@ -1,6 +1,8 @@
 """Teacher-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict, EmailStr
+from pydantic import BaseModel, EmailStr
 from typing import List, Optional
+from datetime import datetime
+from .base import BaseResponse
 
 
 class ScheduleItem(BaseModel):
@@ -26,12 +28,11 @@ class TeacherUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 
-class TeacherResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class TeacherResponse(BaseResponse):
     teacher_id: str
     name: str
     email: str
     phone: Optional[str] = None
     subjects: List[str] = []
     is_active: bool = True
-    created_at: str
+    created_at: datetime
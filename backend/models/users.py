@@ -1,7 +1,14 @@
 """User-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, StringConstraints
+from typing import Annotated, List, Literal, Optional
 from datetime import datetime
+from .base import BaseResponse
+
+# Mirrors config.USER_ROLES
+UserRole = Literal["admin", "gerente", "supervisor", "agente", "maestro"]
+
+# Rejected at parse time, before any token lookup or hashing
+NewPassword = Annotated[str, StringConstraints(min_length=6, max_length=128)]
 
 
 class UserBase(BaseModel):
@@ -17,7 +24,7 @@ class UserCreate(BaseModel):
     email: EmailStr
     name: str
     password: str
-    role: str = "agente"
+    role: UserRole = "agente"
     phone: Optional[str] = None
     assigned_careers: List[str] = []
 
@@ -29,14 +36,13 @@ class UserLogin(BaseModel):
 
 class UserUpdate(BaseModel):
     name: Optional[str] = None
-    role: Optional[str] = None
+    role: Optional[UserRole] = None
     phone: Optional[str] = None
     is_active: Optional[bool] = None
     assigned_careers: Optional[List[str]] = None
 
 
-class UserResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class UserResponse(BaseResponse):
     user_id: str
     email: str
     name: str
@@ -59,8 +65,8 @@ class ForgotPasswordRequest(BaseModel):
 
 class ResetPasswordRequest(BaseModel):
     token: str
-    new_password: str
+    new_password: NewPassword
 
 
 class AdminResetPasswordRequest(BaseModel):
-    new_password: str
+    new_password: NewPassword
@@ -1,7 +1,8 @@
 """Webhook and notification-related Pydantic models"""
-from pydantic import BaseModel, ConfigDict, EmailStr
+from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 from datetime import datetime
+from .base import BaseResponse
 
 
 class WebhookCreate(BaseModel):
@@ -11,8 +12,7 @@ class WebhookCreate(BaseModel):
     is_active: bool = True
 
 
-class WebhookResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class WebhookResponse(BaseResponse):
     webhook_id: str
     name: str
     url: str
@@ -42,8 +42,7 @@ class NotificationSettingsUpdate(BaseModel):
     notify_supervisors: bool = False
 
 
-class NotificationSettingsResponse(BaseModel):
-    model_config = ConfigDict(extra="ignore")
+class NotificationSettingsResponse(BaseResponse):
     settings_id: str
     notification_phone: Optional[str] = None
     notification_webhook_url: Optional[str] = None
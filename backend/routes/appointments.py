@@ -1,59 +1,86 @@
 """Appointment management routes"""
-import uuid
-from fastapi import APIRouter, HTTPException, Request
+import asyncio
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import TypeAdapter
+from pymongo import ReturnDocument
+from pymongo.write_concern import WriteConcern
 from typing import List, Optional
 from datetime import datetime, timezone
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger
+from config import db, logger
 from models.appointments import AppointmentCreate, AppointmentUpdate, AppointmentResponse
 from utils.auth import get_current_user, require_roles
-from utils.helpers import send_notification
+from utils.helpers import send_notification, run_in_background, get_lead_name, get_agent_name
 
 router = APIRouter(prefix="/appointments", tags=["appointments"])
 
+# Built once at import so the list endpoint reuses the same compiled serializer
+_APT_LIST_ADAPTER = TypeAdapter(List[AppointmentResponse])
+
+# Batch imports only need acknowledgement from the primary, not a journal flush
+_bulk_appointments = db.appointments.with_options(write_concern=WriteConcern(w=1, j=False))
+
+# Only the fields AppointmentResponse exposes (created_by, updated_at, ... stay in the DB)
+_APT_RESPONSE_PROJECTION = {
+    "_id": 0, "appointment_id": 1, "lead_id": 1, "lead_name": 1, "agent_id": 1, "agent_name": 1,
+    "title": 1, "description": 1, "scheduled_at": 1, "status": 1, "created_at": 1
+}
+
+
+async def _resolve_names(lead_id: str, agent_id: str):
+    """Fetch the lead and agent display names concurrently"""
+    return await asyncio.gather(get_lead_name(lead_id), get_agent_name(agent_id))
+
+
+def _appointment_filter(appointment_id: str) -> dict:
+    """Match an appointment by its public id.
+
+    New appointments are keyed by their ObjectId; appointments created before
+    that still carry a legacy ``apt_...`` appointment_id field.
+    """
+    if ObjectId.is_valid(appointment_id):
+        return {"_id": ObjectId(appointment_id)}
+    return {"appointment_id": appointment_id}
+
 
 @router.post("", response_model=AppointmentResponse)
 async def create_appointment(appointment_data: AppointmentCreate, request: Request):
     current_user = await get_current_user(request)
     
-    appointment_id = f"apt_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc)
     
-    # Get lead and agent names
-    lead = await db.leads.find_one({"lead_id": appointment_data.lead_id}, {"_id": 0})
-    agent = await db.users.find_one({"user_id": appointment_data.agent_id}, {"_id": 0})
+    # Get lead and agent names (not stored, they are joined on read)
+    lead_name, agent_name = await _resolve_names(appointment_data.lead_id, appointment_data.agent_id)
     
     appointment = {
-        "appointment_id": appointment_id,
         "lead_id": appointment_data.lead_id,
-        "lead_name": lead["full_name"] if lead else None,
         "agent_id": appointment_data.agent_id,
-        "agent_name": agent["name"] if agent else None,
         "title": appointment_data.title,
         "description": appointment_data.description,
-        "scheduled_at": appointment_data.scheduled_at.isoformat(),
+        "scheduled_at": appointment_data.scheduled_at,
         "status": "scheduled",
-        "created_at": now.isoformat(),
+        "created_at": now,
         "created_by": current_user["user_id"]
     }
     
-    await db.appointments.insert_one(appointment)
-    appointment.pop("_id", None)
+    result = await db.appointments.insert_one(appointment)
+    appointment_id = str(result.inserted_id)
     
-    # Send notification
-    await send_notification("appointment.created", {
+    # Send notification without holding up the response
+    run_in_background(send_notification("appointment.created", {
         "appointment_id": appointment_id,
         "title": appointment_data.title,
         "scheduled_at": appointment_data.scheduled_at.isoformat(),
-        "lead_name": lead["full_name"] if lead else None
-    })
+        "lead_name": lead_name
+    }))
     
     return AppointmentResponse(
         appointment_id=appointment_id,
         lead_id=appointment_data.lead_id,
-        lead_name=lead["full_name"] if lead else None,
+        lead_name=lead_name,
         agent_id=appointment_data.agent_id,
-        agent_name=agent["name"] if agent else None,
+        agent_name=agent_name,
         title=appointment_data.title,
         description=appointment_data.description,
         scheduled_at=appointment_data.scheduled_at,
@@ -62,14 +89,74 @@ async def create_appointment(appointment_data: AppointmentCreate, request: Reque
     )
 
 
+@router.post("/bulk", response_model=List[AppointmentResponse])
+async def create_appointments_bulk(appointments_data: List[AppointmentCreate], request: Request):
+    """Create several appointments with a single insert_many"""
+    current_user = await get_current_user(request)
+    
+    if not appointments_data:
+        return []
+    
+    now = datetime.now(timezone.utc)
+    
+    # Resolve all lead/agent names with one $in query per collection
+    lead_ids = list({a.lead_id for a in appointments_data})
+    agent_ids = list({a.agent_id for a in appointments_data})
+    leads, agents = await asyncio.gather(
+        db.leads.find({"lead_id": {"$in": lead_ids}}, {"_id": 0, "lead_id": 1, "full_name": 1}).to_list(len(lead_ids)),
+        db.users.find({"user_id": {"$in": agent_ids}}, {"_id": 0, "user_id": 1, "name": 1}).to_list(len(agent_ids))
+    )
+    lead_map = {l["lead_id"]: l["full_name"] for l in leads}
+    agent_map = {a["user_id"]: a["name"] for a in agents}
+    
+    appointments = [
+        {
+            "lead_id": a.lead_id,
+            "agent_id": a.agent_id,
+            "title": a.title,
+            "description": a.description,
+            "scheduled_at": a.scheduled_at,
+            "status": "scheduled",
+            "created_at": now,
+            "created_by": current_user["user_id"]
+        }
+        for a in appointments_data
+    ]
+    
+    result = await _bulk_appointments.insert_many(appointments, ordered=False)
+    
+    response = []
+    for appointment, inserted_id in zip(appointments, result.inserted_ids):
+        appointment.pop("_id", None)
+        appointment.pop("created_by")
+        appointment["appointment_id"] = str(inserted_id)
+        appointment["lead_name"] = lead_map.get(appointment["lead_id"])
+        appointment["agent_name"] = agent_map.get(appointment["agent_id"])
+        response.append(AppointmentResponse.model_construct(**appointment))
+        
+        run_in_background(send_notification("appointment.created", {
+            "appointment_id": appointment["appointment_id"],
+            "title": appointment["title"],
+            "scheduled_at": appointment["scheduled_at"].isoformat(),
+            "lead_name": appointment["lead_name"]
+        }))
+    
+    logger.info(f"Bulk created {len(response)} appointments")
+    return response
+
+
 @router.get("", response_model=List[AppointmentResponse])
 async def get_appointments(
     request: Request,
     agent_id: Optional[str] = None,
-    status: Optional[str] = None
+    status: Optional[str] = None,
+    limit: int = 1000,
+    after: Optional[datetime] = None,
+    after_id: Optional[str] = None
 ):
     current_user = await get_current_user(request)
     
+    limit = max(1, min(limit, 1000))
     query = {}
     
     # Role-based filtering
@@ -81,81 +168,91 @@ async def get_appointments(
     if status:
         query["status"] = status
     
-    appointments = await db.appointments.find(query, {"_id": 0}).sort("scheduled_at", 1).to_list(1000)
+    # Keyset pagination: resume after the (scheduled_at, _id) of the last item seen
+    after_oid = None
+    if after and after_id:
+        after_filter = _appointment_filter(after_id)
+        if "_id" in after_filter:
+            after_oid = after_filter["_id"]
+        else:
+            last_seen = await db.appointments.find_one(after_filter, {"_id": 1})
+            after_oid = last_seen["_id"] if last_seen else None
+    if after_oid:
+        query["$or"] = [
+            {"scheduled_at": {"$gt": after}},
+            {"scheduled_at": after, "_id": {"$gt": after_oid}}
+        ]
+    elif after:
+        query["scheduled_at"] = {"$gt": after}
     
-    result = []
-    for apt in appointments:
-        scheduled_at = apt.get("scheduled_at")
-        created_at = apt.get("created_at")
-        if isinstance(scheduled_at, str):
-            scheduled_at = datetime.fromisoformat(scheduled_at)
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        
-        result.append(AppointmentResponse(
-            appointment_id=apt["appointment_id"],
-            lead_id=apt["lead_id"],
-            lead_name=apt.get("lead_name"),
-            agent_id=apt["agent_id"],
-            agent_name=apt.get("agent_name"),
-            title=apt["title"],
-            description=apt.get("description"),
-            scheduled_at=scheduled_at,
-            status=apt["status"],
-            created_at=created_at
-        ))
-    
-    return result
+    # Join lead/agent names server-side so they stay consistent with the source documents
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"scheduled_at": 1, "_id": 1}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "leads",
+            "localField": "lead_id",
+            "foreignField": "lead_id",
+            "as": "_lead",
+            "pipeline": [{"$project": {"_id": 0, "full_name": 1}}]
+        }},
+        {"$lookup": {
+            "from": "users",
+            "localField": "agent_id",
+            "foreignField": "user_id",
+            "as": "_agent",
+            "pipeline": [{"$project": {"_id": 0, "name": 1}}]
+        }},
+        {"$addFields": {
+            "appointment_id": {"$ifNull": ["$appointment_id", {"$toString": "$_id"}]},
+            "lead_name": {"$ifNull": [{"$arrayElemAt": ["$_lead.full_name", 0]}, "$lead_name"]},
+            "agent_name": {"$ifNull": [{"$arrayElemAt": ["$_agent.name", 0]}, "$agent_name"]}
+        }},
+        {"$project": _APT_RESPONSE_PROJECTION}
+    ]
+    
+    # Documents come from our own collection, so skip per-row validation and
+    # serialize the whole list in one pass instead of going through response_model
+    construct = AppointmentResponse.model_construct
+    result = [construct(**apt) async for apt in await db.appointments.aggregate(pipeline)]
+    
+    return Response(
+        content=_APT_LIST_ADAPTER.dump_json(result, warnings=False),
+        media_type="application/json"
+    )
 
 
 @router.put("/{appointment_id}", response_model=AppointmentResponse)
 async def update_appointment(appointment_id: str, update_data: AppointmentUpdate, request: Request):
     await get_current_user(request)
     
-    appointment = await db.appointments.find_one({"appointment_id": appointment_id}, {"_id": 0})
+    # Datetimes are kept as datetime objects and stored as native BSON dates
+    update_dict = update_data.model_dump(exclude_none=True)
+    update_dict["updated_at"] = datetime.now(timezone.utc)
+    
+    appointment = await db.appointments.find_one_and_update(
+        _appointment_filter(appointment_id),
+        {"$set": update_dict},
+        projection=_APT_RESPONSE_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
     if not appointment:
         raise HTTPException(status_code=404, detail="Cita no encontrada")
     
-    update_dict = {}
-    for k, v in update_data.model_dump().items():
-        if v is not None:
-            if k == "scheduled_at":
-                update_dict[k] = v.isoformat()
-            else:
-                update_dict[k] = v
-    
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
-    
-    await db.appointments.update_one({"appointment_id": appointment_id}, {"$set": update_dict})
+    appointment.setdefault("appointment_id", appointment_id)
+    lead_name, agent_name = await _resolve_names(appointment["lead_id"], appointment["agent_id"])
     
-    appointment = await db.appointments.find_one({"appointment_id": appointment_id}, {"_id": 0})
-    
-    scheduled_at = appointment.get("scheduled_at")
-    created_at = appointment.get("created_at")
-    if isinstance(scheduled_at, str):
-        scheduled_at = datetime.fromisoformat(scheduled_at)
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at)
-    
-    return AppointmentResponse(
-        appointment_id=appointment["appointment_id"],
-        lead_id=appointment["lead_id"],
-        lead_name=appointment.get("lead_name"),
-        agent_id=appointment["agent_id"],
-        agent_name=appointment.get("agent_name"),
-        title=appointment["title"],
-        description=appointment.get("description"),
-        scheduled_at=scheduled_at,
-        status=appointment["status"],
-        created_at=created_at
-    )
+    appointment["lead_name"] = lead_name or appointment.get("lead_name")
+    appointment["agent_name"] = agent_name or appointment.get("agent_name")
+    return AppointmentResponse.model_construct(**appointment)
 
 
 @router.delete("/{appointment_id}")
 async def delete_appointment(appointment_id: str, request: Request):
     await get_current_user(request)
     
-    result = await db.appointments.delete_one({"appointment_id": appointment_id})
+    result = await db.appointments.delete_one(_appointment_filter(appointment_id))
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cita no encontrada")
     
@@ -1,16 +1,76 @@
 """Google Calendar integration routes"""
-import uuid
+import secrets
+import orjson
 from urllib.parse import urlencode
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
+from typing import Dict, Optional, Tuple
 from datetime import datetime, timezone, timedelta
 import os
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_CALENDAR_SCOPES
-from utils.auth import get_current_user
+from config import db, logger, http_client, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_CALENDAR_SCOPES
+from utils.auth import get_current_user, hash_token, token_matches
+from utils.helpers import parse_dt
 
 router = APIRouter(prefix="/auth/google/calendar", tags=["calendar"])
 
+GOOGLE_CALENDAR_EVENTS_URL = "https://www.googleapis.com/calendar/v3/calendars/primary/events"
+GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
+# Only the event fields the CRM shows; Google otherwise returns every field of every event
+GOOGLE_EVENT_FIELDS = "items(id,summary,description,start,end,htmlLink,attendees/email,status),nextPageToken"
+
+# user_id -> (access_token, expires_at); saves the Mongo read on every calendar call
+_access_token_cache: Dict[str, Tuple[str, datetime]] = {}
+# Refresh a little before Google's expiry so in-flight requests don't fail
+_TOKEN_REFRESH_MARGIN = timedelta(seconds=60)
+
+
+async def _get_valid_access_token(user_id: str) -> str:
+    """Return a usable Google access token for the user, refreshing it if needed"""
+    now = datetime.now(timezone.utc)
+    cached = _access_token_cache.get(user_id)
+    if cached and cached[1] - now > _TOKEN_REFRESH_MARGIN:
+        return cached[0]
+    
+    token = await db.google_calendar_tokens.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "access_token": 1, "refresh_token": 1, "expires_at": 1}
+    )
+    if not token:
+        raise HTTPException(status_code=400, detail="Google Calendar no conectado")
+    
+    access_token = token["access_token"]
+    # Tokens saved before dates were stored natively have an ISO-string expiry
+    expires_at = parse_dt(token["expires_at"])
+    
+    if expires_at - now <= _TOKEN_REFRESH_MARGIN:
+        if not token.get("refresh_token"):
+            raise HTTPException(status_code=400, detail="Token expirado, reconecta Google Calendar")
+        
+        refresh_data = {
+            "client_id": GOOGLE_CLIENT_ID,
+            "client_secret": GOOGLE_CLIENT_SECRET,
+            "refresh_token": token["refresh_token"],
+            "grant_type": "refresh_token"
+        }
+        
+        response = await http_client.post(GOOGLE_TOKEN_URL, data=refresh_data)
+        if response.status_code != 200:
+            raise HTTPException(status_code=400, detail="No se pudo refrescar el token")
+        
+        new_tokens = response.json()
+        access_token = new_tokens["access_token"]
+        expires_at = now + timedelta(seconds=new_tokens["expires_in"])
+        
+        # Update stored token
+        await db.google_calendar_tokens.update_one(
+            {"user_id": user_id},
+            {"$set": {"access_token": access_token, "expires_at": expires_at}}
+        )
+    
+    _access_token_cache[user_id] = (access_token, expires_at)
+    return access_token
+
 
 @router.get("/connect")
 async def initiate_google_calendar_oauth(request: Request):
@@ -21,13 +81,13 @@ async def initiate_google_calendar_oauth(request: Request):
         raise HTTPException(status_code=500, detail="Google Calendar no está configurado")
     
     # Generate state token
-    state = f"{current_user['user_id']}_{uuid.uuid4().hex[:8]}"
+    state = f"{current_user['user_id']}_{secrets.token_urlsafe(16)}"
     
     # Store state in database
     await db.oauth_states.insert_one({
-        "state": state,
+        "state_hash": hash_token(state),
         "user_id": current_user["user_id"],
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
     
     # Get the callback URL from the frontend URL
@@ -57,8 +117,6 @@ async def initiate_google_calendar_oauth(request: Request):
 @router.get("/callback")
 async def google_calendar_oauth_callback(request: Request, code: str = None, state: str = None, error: str = None):
     """Handle Google Calendar OAuth callback"""
-    import httpx
-    
     if error:
         logger.error(f"Google Calendar OAuth error: {error}")
         frontend_url = os.environ.get('FRONTEND_URL', '')
@@ -67,16 +125,14 @@ async def google_calendar_oauth_callback(request: Request, code: str = None, sta
     if not code or not state:
         raise HTTPException(status_code=400, detail="Código o estado faltante")
     
-    # Verify state
-    oauth_state = await db.oauth_states.find_one({"state": state}, {"_id": 0})
-    if not oauth_state:
+    # Verify and consume the state in one step (stored as a SHA-256 digest)
+    state_hash = hash_token(state)
+    oauth_state = await db.oauth_states.find_one_and_delete({"state_hash": state_hash}, {"_id": 0, "state_hash": 1, "user_id": 1})
+    if not oauth_state or not token_matches(oauth_state["state_hash"], state_hash):
         raise HTTPException(status_code=400, detail="Estado inválido")
     
     user_id = oauth_state["user_id"]
     
-    # Clean up state
-    await db.oauth_states.delete_one({"state": state})
-    
     # Get the callback URL
     frontend_url = os.environ.get('FRONTEND_URL', '')
     if frontend_url:
@@ -85,7 +141,6 @@ async def google_calendar_oauth_callback(request: Request, code: str = None, sta
         callback_url = str(request.base_url).rstrip('/') + '/api/auth/google/calendar/callback'
     
     # Exchange code for tokens
-    token_url = "https://oauth2.googleapis.com/token"
     token_data = {
         "client_id": GOOGLE_CLIENT_ID,
         "client_secret": GOOGLE_CLIENT_SECRET,
@@ -94,14 +149,13 @@ async def google_calendar_oauth_callback(request: Request, code: str = None, sta
         "redirect_uri": callback_url
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, data=token_data)
-        
-        if response.status_code != 200:
-            logger.error(f"Token exchange failed: {response.text}")
-            return RedirectResponse(url=f"{frontend_url}/calendar?error=token_exchange_failed")
-        
-        tokens = response.json()
+    response = await http_client.post(GOOGLE_TOKEN_URL, data=token_data)
+    
+    if response.status_code != 200:
+        logger.error(f"Token exchange failed: {response.text}")
+        return RedirectResponse(url=f"{frontend_url}/calendar?error=token_exchange_failed")
+    
+    tokens = response.json()
     
     # Store tokens
     now = datetime.now(timezone.utc)
@@ -110,9 +164,9 @@ async def google_calendar_oauth_callback(request: Request, code: str = None, sta
         "access_token": tokens["access_token"],
         "refresh_token": tokens.get("refresh_token"),
         "token_type": tokens["token_type"],
-        "expires_at": (now + timedelta(seconds=tokens["expires_in"])).isoformat(),
+        "expires_at": now + timedelta(seconds=tokens["expires_in"]),
         "scope": tokens.get("scope"),
-        "created_at": now.isoformat()
+        "created_at": now
     }
     
     # Upsert token document
@@ -121,6 +175,7 @@ async def google_calendar_oauth_callback(request: Request, code: str = None, sta
         {"$set": token_doc},
         upsert=True
     )
+    _access_token_cache.pop(user_id, None)
     
     logger.info(f"Google Calendar connected for user {user_id}")
     
@@ -132,20 +187,17 @@ async def get_calendar_connection_status(request: Request):
     """Check if user has connected Google Calendar"""
     current_user = await get_current_user(request)
     
-    token = await db.google_calendar_tokens.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
+    token = await db.google_calendar_tokens.find_one({"user_id": current_user["user_id"]}, {"_id": 0, "expires_at": 1})
     
     if token:
         # Check if token is expired
-        expires_at = datetime.fromisoformat(token["expires_at"])
-        if expires_at.tzinfo is None:
-            expires_at = expires_at.replace(tzinfo=timezone.utc)
-        
+        expires_at = parse_dt(token["expires_at"])
         is_expired = expires_at < datetime.now(timezone.utc)
         
         return {
             "connected": True,
             "is_expired": is_expired,
-            "expires_at": token["expires_at"]
+            "expires_at": expires_at
         }
     
     return {"connected": False}
@@ -157,90 +209,43 @@ async def disconnect_google_calendar(request: Request):
     current_user = await get_current_user(request)
     
     await db.google_calendar_tokens.delete_one({"user_id": current_user["user_id"]})
+    _access_token_cache.pop(current_user["user_id"], None)
     
     return {"message": "Google Calendar desconectado"}
 
 
 @router.get("/events")
-async def get_calendar_events(request: Request):
+async def get_calendar_events(request: Request, page_token: Optional[str] = None):
     """Get calendar events from Google Calendar"""
-    import httpx
-    from google.oauth2.credentials import Credentials
-    from googleapiclient.discovery import build
-    
     current_user = await get_current_user(request)
     
-    token = await db.google_calendar_tokens.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
-    if not token:
-        raise HTTPException(status_code=400, detail="Google Calendar no conectado")
-    
-    # Check if token needs refresh
-    expires_at = datetime.fromisoformat(token["expires_at"])
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    
-    access_token = token["access_token"]
-    
-    if expires_at < datetime.now(timezone.utc):
-        # Refresh token
-        if not token.get("refresh_token"):
-            raise HTTPException(status_code=400, detail="Token expirado, reconecta Google Calendar")
-        
-        token_url = "https://oauth2.googleapis.com/token"
-        refresh_data = {
-            "client_id": GOOGLE_CLIENT_ID,
-            "client_secret": GOOGLE_CLIENT_SECRET,
-            "refresh_token": token["refresh_token"],
-            "grant_type": "refresh_token"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(token_url, data=refresh_data)
-            if response.status_code != 200:
-                raise HTTPException(status_code=400, detail="No se pudo refrescar el token")
-            
-            new_tokens = response.json()
-            access_token = new_tokens["access_token"]
-            
-            # Update stored token
-            now = datetime.now(timezone.utc)
-            await db.google_calendar_tokens.update_one(
-                {"user_id": current_user["user_id"]},
-                {"$set": {
-                    "access_token": access_token,
-                    "expires_at": (now + timedelta(seconds=new_tokens["expires_in"])).isoformat()
-                }}
-            )
+    access_token = await _get_valid_access_token(current_user["user_id"])
     
     # Get events from Google Calendar
     try:
-        credentials = Credentials(
-            token=access_token,
-            refresh_token=token.get("refresh_token"),
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=GOOGLE_CLIENT_ID,
-            client_secret=GOOGLE_CLIENT_SECRET
-        )
-        
-        service = build("calendar", "v3", credentials=credentials)
-        
         # Get events for the next 30 days
         now = datetime.now(timezone.utc)
-        time_min = now.isoformat()
-        time_max = (now + timedelta(days=30)).isoformat()
+        params = {
+            "timeMin": now.isoformat(),
+            "timeMax": (now + timedelta(days=30)).isoformat(),
+            "maxResults": 100,
+            "singleEvents": "true",
+            "orderBy": "startTime",
+            "fields": GOOGLE_EVENT_FIELDS
+        }
+        if page_token:
+            params["pageToken"] = page_token
         
-        events_result = service.events().list(
-            calendarId="primary",
-            timeMin=time_min,
-            timeMax=time_max,
-            maxResults=100,
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute()
+        response = await http_client.get(
+            GOOGLE_CALENDAR_EVENTS_URL,
+            params=params,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        response.raise_for_status()
         
-        events = events_result.get("items", [])
+        data = orjson.loads(response.content)
         
-        return {"events": events}
+        return {"events": data.get("items", []), "next_page_token": data.get("nextPageToken")}
     
     except Exception as e:
         logger.error(f"Error fetching calendar events: {e}")
@@ -250,64 +255,12 @@ async def get_calendar_events(request: Request):
 @router.post("/events")
 async def create_calendar_event(request: Request):
     """Create a new event in Google Calendar"""
-    import httpx
-    from google.oauth2.credentials import Credentials
-    from googleapiclient.discovery import build
-    
     current_user = await get_current_user(request)
     body = await request.json()
     
-    token = await db.google_calendar_tokens.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
-    if not token:
-        raise HTTPException(status_code=400, detail="Google Calendar no conectado")
-    
-    # Get access token (refresh if needed)
-    expires_at = datetime.fromisoformat(token["expires_at"])
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    
-    access_token = token["access_token"]
-    
-    if expires_at < datetime.now(timezone.utc):
-        if not token.get("refresh_token"):
-            raise HTTPException(status_code=400, detail="Token expirado, reconecta Google Calendar")
-        
-        token_url = "https://oauth2.googleapis.com/token"
-        refresh_data = {
-            "client_id": GOOGLE_CLIENT_ID,
-            "client_secret": GOOGLE_CLIENT_SECRET,
-            "refresh_token": token["refresh_token"],
-            "grant_type": "refresh_token"
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(token_url, data=refresh_data)
-            if response.status_code != 200:
-                raise HTTPException(status_code=400, detail="No se pudo refrescar el token")
-            
-            new_tokens = response.json()
-            access_token = new_tokens["access_token"]
-            
-            now = datetime.now(timezone.utc)
-            await db.google_calendar_tokens.update_one(
-                {"user_id": current_user["user_id"]},
-                {"$set": {
-                    "access_token": access_token,
-                    "expires_at": (now + timedelta(seconds=new_tokens["expires_in"])).isoformat()
-                }}
-            )
+    access_token = await _get_valid_access_token(current_user["user_id"])
     
     try:
-        credentials = Credentials(
-            token=access_token,
-            refresh_token=token.get("refresh_token"),
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=GOOGLE_CLIENT_ID,
-            client_secret=GOOGLE_CLIENT_SECRET
-        )
-        
-        service = build("calendar", "v3", credentials=credentials)
-        
         event = {
             "summary": body.get("title", "Cita UCIC"),
             "description": body.get("description", ""),
@@ -331,7 +284,13 @@ async def create_calendar_event(request: Request):
         if body.get("attendees"):
             event["attendees"] = [{"email": email} for email in body["attendees"]]
         
-        created_event = service.events().insert(calendarId="primary", body=event).execute()
+        response = await http_client.post(
+            GOOGLE_CALENDAR_EVENTS_URL,
+            json=event,
+            headers={"Authorization": f"Bearer {access_token}"}
+        )
+        response.raise_for_status()
+        created_event = response.json()
         
         return {
             "success": True,
@@ -1,23 +1,41 @@
 """Career management routes"""
+import asyncio
 import uuid
 from fastapi import APIRouter, HTTPException, Request
+from pymongo import ReturnDocument
 from typing import List
 from datetime import datetime, timezone
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger
+from config import db, logger
 from models.careers import CareerCreate, CareerUpdate, CareerResponse
 from utils.auth import get_current_user, require_roles
+from utils.helpers import get_career_options_cached, invalidate_career_options
 
 router = APIRouter(prefix="/careers", tags=["careers"])
 
 
+async def _add_teacher_names(schedules: List[dict]) -> List[dict]:
+    """Fill in teacher_name on each schedule with a single teachers query"""
+    teacher_ids = list({s["teacher_id"] for s in schedules if s.get("teacher_id")})
+    if teacher_ids:
+        teachers = await db.teachers.find(
+            {"teacher_id": {"$in": teacher_ids}},
+            {"_id": 0, "teacher_id": 1, "name": 1}
+        ).to_list(len(teacher_ids))
+        teacher_names = {t["teacher_id"]: t["name"] for t in teachers}
+        for schedule in schedules:
+            if schedule.get("teacher_id") in teacher_names:
+                schedule["teacher_name"] = teacher_names[schedule["teacher_id"]]
+    return schedules
+
+
 @router.post("/full", response_model=CareerResponse)
 async def create_career_full(career_data: CareerCreate, request: Request):
     """Create a career with schedules"""
     await require_roles(["admin", "gerente"])(request)
     
     # Check if career name already exists
-    existing = await db.careers_full.find_one({"name": career_data.name}, {"_id": 0})
+    existing = await db.careers_full.find_one({"name": career_data.name}, {"_id": 1})
     if existing:
         raise HTTPException(status_code=400, detail="La carrera ya existe")
     
@@ -25,14 +43,7 @@ async def create_career_full(career_data: CareerCreate, request: Request):
     now = datetime.now(timezone.utc)
     
     # Process schedules to add teacher names
-    schedules = []
-    for schedule in career_data.schedules:
-        schedule_dict = schedule.model_dump()
-        if schedule.teacher_id:
-            teacher = await db.teachers.find_one({"teacher_id": schedule.teacher_id}, {"_id": 0})
-            if teacher:
-                schedule_dict["teacher_name"] = teacher["name"]
-        schedules.append(schedule_dict)
+    schedules = await _add_teacher_names([s.model_dump() for s in career_data.schedules])
     
     career = {
         "career_id": career_id,
@@ -41,23 +52,24 @@ async def create_career_full(career_data: CareerCreate, request: Request):
         "modality": career_data.modality,
         "schedules": schedules,
         "is_active": True,
-        "created_at": now.isoformat(),
-        "updated_at": now.isoformat()
+        "created_at": now,
+        "updated_at": now
     }
     
-    await db.careers_full.insert_one(career)
-    career.pop("_id", None)
-    
-    # Also add to the simple careers list if not exists
-    careers_doc = await db.settings.find_one({"type": "careers"}, {"_id": 0})
-    if careers_doc and career_data.name not in careers_doc.get("items", []):
-        await db.settings.update_one(
+    # Also add to the simple careers list ($addToSet skips names already there)
+    await asyncio.gather(
+        db.careers_full.insert_one(career),
+        db.settings.update_one(
             {"type": "careers"},
-            {"$push": {"items": career_data.name}}
+            {"$addToSet": {"items": career_data.name}},
+            upsert=True
         )
+    )
+    career.pop("_id", None)
+    invalidate_career_options()
     
     logger.info(f"Career created: {career_id}")
-    return CareerResponse(**career)
+    return CareerResponse.model_validate(career)
 
 
 @router.get("/full", response_model=List[CareerResponse])
@@ -66,7 +78,8 @@ async def get_careers_full(request: Request):
     await get_current_user(request)
     
     careers = await db.careers_full.find({}, {"_id": 0}).to_list(1000)
-    return [CareerResponse(**c) for c in careers]
+    validate = CareerResponse.model_validate
+    return [validate(c) for c in careers]
 
 
 @router.get("/full/{career_id}", response_model=CareerResponse)
@@ -78,7 +91,7 @@ async def get_career_full(career_id: str, request: Request):
     if not career:
         raise HTTPException(status_code=404, detail="Carrera no encontrada")
     
-    return CareerResponse(**career)
+    return CareerResponse.model_validate(career)
 
 
 @router.put("/full/{career_id}", response_model=CareerResponse)
@@ -86,33 +99,30 @@ async def update_career_full(career_id: str, career_data: CareerUpdate, request:
     """Update a career"""
     await require_roles(["admin", "gerente"])(request)
     
-    career = await db.careers_full.find_one({"career_id": career_id}, {"_id": 0})
-    if not career:
-        raise HTTPException(status_code=404, detail="Carrera no encontrada")
-    
     update_data = {}
     for k, v in career_data.model_dump().items():
         if v is not None:
             if k == "schedules":
                 # Process schedules to add teacher names
-                schedules = []
-                for schedule in v:
-                    schedule_dict = schedule if isinstance(schedule, dict) else schedule.model_dump()
-                    if schedule_dict.get("teacher_id"):
-                        teacher = await db.teachers.find_one({"teacher_id": schedule_dict["teacher_id"]}, {"_id": 0})
-                        if teacher:
-                            schedule_dict["teacher_name"] = teacher["name"]
-                    schedules.append(schedule_dict)
-                update_data["schedules"] = schedules
+                update_data["schedules"] = await _add_teacher_names(
+                    [s if isinstance(s, dict) else s.model_dump() for s in v]
+                )
             else:
                 update_data[k] = v
     
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.careers_full.update_one({"career_id": career_id}, {"$set": update_data})
+    updated_career = await db.careers_full.find_one_and_update(
+        {"career_id": career_id},
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_career:
+        raise HTTPException(status_code=404, detail="Carrera no encontrada")
+    invalidate_career_options()
     
-    updated_career = await db.careers_full.find_one({"career_id": career_id}, {"_id": 0})
-    return CareerResponse(**updated_career)
+    return CareerResponse.model_validate(updated_career)
 
 
 @router.delete("/full/{career_id}")
@@ -120,17 +130,19 @@ async def delete_career_full(career_id: str, request: Request):
     """Delete a career"""
     await require_roles(["admin"])(request)
     
-    career = await db.careers_full.find_one({"career_id": career_id}, {"_id": 0})
+    career = await db.careers_full.find_one({"career_id": career_id}, {"_id": 0, "name": 1})
     if not career:
         raise HTTPException(status_code=404, detail="Carrera no encontrada")
     
-    # Remove from simple careers list
-    await db.settings.update_one(
-        {"type": "careers"},
-        {"$pull": {"items": career["name"]}}
+    # Remove from simple careers list alongside the delete
+    await asyncio.gather(
+        db.settings.update_one(
+            {"type": "careers"},
+            {"$pull": {"items": career["name"]}}
+        ),
+        db.careers_full.delete_one({"career_id": career_id})
     )
-    
-    await db.careers_full.delete_one({"career_id": career_id})
+    invalidate_career_options()
     
     return {"message": "Carrera eliminada"}
 
@@ -139,16 +151,17 @@ async def delete_career_full(career_id: str, request: Request):
 async def get_careers_list(request: Request):
     """Get simple list of career names (for dropdowns)"""
     await get_current_user(request)
-    
-    # Get from careers_full collection
-    careers = await db.careers_full.find({"is_active": True}, {"_id": 0, "name": 1}).to_list(1000)
-    career_names = [c["name"] for c in careers]
-    
-    # Also check settings for any additional careers
-    settings = await db.settings.find_one({"type": "careers"}, {"_id": 0})
+    return {"careers": await get_career_options_cached("list", _load_careers_list)}
+
+
+async def _load_careers_list():
+    # careers_full names first, then any additional names from settings (queried in parallel)
+    careers, settings = await asyncio.gather(
+        db.careers_full.find({"is_active": True}, {"_id": 0, "name": 1}).to_list(1000),
+        db.settings.find_one({"type": "careers"}, {"_id": 0, "items": 1})
+    )
+    career_names = dict.fromkeys(c["name"] for c in careers)
     if settings:
-        for name in settings.get("items", []):
-            if name not in career_names:
-                career_names.append(name)
+        career_names.update(dict.fromkeys(settings.get("items", [])))
     
-    return {"careers": career_names}
+    return list(career_names)
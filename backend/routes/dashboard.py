@@ -1,136 +1,189 @@
 """Dashboard routes"""
+import asyncio
 from fastapi import APIRouter, Request
+from typing import Optional
 from datetime import datetime, timezone, timedelta
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db
+from config import db, logger, DEFAULT_CAREERS, LEAD_SOURCES, LEAD_STATUSES
 from models.dashboard import DashboardStats
 from utils.auth import get_current_user
+from utils.helpers import get_career_options_cached
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
+# The sources/statuses dropdowns are constants, so their payloads are built once
+_SOURCE_OPTIONS = {"sources": LEAD_SOURCES}
+_STATUS_OPTIONS = {"statuses": LEAD_STATUSES}
 
-@router.get("/stats", response_model=DashboardStats)
-async def get_dashboard_stats(request: Request):
-    current_user = await get_current_user(request)
-    
+
+# Admin/gerente stats are identical for every user, so a background loop
+# keeps them in dashboard_snapshots and the endpoint just reads that document
+DASHBOARD_SNAPSHOT_INTERVAL = 30
+
+
+async def _compute_stats(agent_id: Optional[str] = None) -> dict:
+    """Run the dashboard aggregation, scoped to one agent or (agent_id=None) global"""
     # Base query for role-based filtering
     base_query = {}
-    if current_user["role"] == "agente":
-        base_query["assigned_agent_id"] = current_user["user_id"]
-    
-    # Total leads
-    total_leads = await db.leads.count_documents(base_query)
-    
-    # Leads by status
-    pipeline = [
-        {"$match": base_query},
-        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-    ]
-    status_results = await db.leads.aggregate(pipeline).to_list(100)
-    leads_by_status = {r["_id"]: r["count"] for r in status_results}
-    
-    # Leads by source
-    pipeline = [
-        {"$match": base_query},
-        {"$group": {"_id": "$source", "count": {"$sum": 1}}}
-    ]
-    source_results = await db.leads.aggregate(pipeline).to_list(100)
-    leads_by_source = {r["_id"]: r["count"] for r in source_results}
-    
-    # Leads by career
-    pipeline = [
-        {"$match": base_query},
-        {"$group": {"_id": "$career_interest", "count": {"$sum": 1}}}
-    ]
-    career_results = await db.leads.aggregate(pipeline).to_list(100)
-    leads_by_career = {r["_id"]: r["count"] for r in career_results}
-    
-    # Leads by agent (only for admin/gerente)
-    leads_by_agent = {}
-    if current_user["role"] in ["admin", "gerente"]:
-        pipeline = [
-            {"$match": {"assigned_agent_id": {"$ne": None}}},
-            {"$group": {"_id": "$assigned_agent_id", "count": {"$sum": 1}}}
-        ]
-        agent_results = await db.leads.aggregate(pipeline).to_list(100)
-        
-        # Get agent names
-        agent_ids = [r["_id"] for r in agent_results]
-        agents = await db.users.find({"user_id": {"$in": agent_ids}}, {"_id": 0}).to_list(1000)
-        agent_map = {a["user_id"]: a["name"] for a in agents}
-        
-        leads_by_agent = {agent_map.get(r["_id"], r["_id"]): r["count"] for r in agent_results}
+    if agent_id:
+        base_query["assigned_agent_id"] = agent_id
     
-    # Conversion rate (etapa_4_inscrito / total)
-    converted = leads_by_status.get("etapa_4_inscrito", 0)
-    conversion_rate = (converted / total_leads * 100) if total_leads > 0 else 0
-    
-    # Today's stats
+    # Today's window
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    today_query = {**base_query, "created_at": {"$gte": today_start.isoformat()}}
-    new_leads_today = await db.leads.count_documents(today_query)
-    
-    # Today's appointments
     today_end = today_start + timedelta(days=1)
+    
     apt_query = {
         "scheduled_at": {
-            "$gte": today_start.isoformat(),
-            "$lt": today_end.isoformat()
+            "$gte": today_start,
+            "$lt": today_end
         }
     }
-    if current_user["role"] == "agente":
-        apt_query["agent_id"] = current_user["user_id"]
-    appointments_today = await db.appointments.count_documents(apt_query)
-    
-    return DashboardStats(
-        total_leads=total_leads,
-        leads_by_status=leads_by_status,
-        leads_by_source=leads_by_source,
-        leads_by_career=leads_by_career,
-        leads_by_agent=leads_by_agent,
-        conversion_rate=round(conversion_rate, 2),
-        new_leads_today=new_leads_today,
-        appointments_today=appointments_today
+    if agent_id:
+        apt_query["agent_id"] = agent_id
+    
+    def group_by(field: str):
+        return [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]
+    
+    # One pass over the filtered leads computes every breakdown
+    facets = {
+        "total": [{"$count": "n"}],
+        # Leads are stored with BSON dates; older ones still have ISO strings
+        "today": [{"$match": {"$or": [
+            {"created_at": {"$gte": today_start}},
+            {"created_at": {"$gte": today_start.isoformat()}}
+        ]}}, {"$count": "n"}],
+        "by_status": group_by("status"),
+        "by_source": group_by("source"),
+        "by_career": group_by("career_interest")
+    }
+    # Leads by agent only for the global (admin/gerente) scope
+    if not agent_id:
+        facets["by_agent"] = [{"$match": {"assigned_agent_id": {"$ne": None}}}] + group_by("assigned_agent_id") + [
+            {"$lookup": {
+                "from": "users",
+                "localField": "_id",
+                "foreignField": "user_id",
+                "as": "_agent",
+                "pipeline": [{"$project": {"_id": 0, "name": 1}}]
+            }},
+            # Fall back to the id when the agent no longer exists
+            {"$project": {"_id": 0, "count": 1, "name": {"$ifNull": [{"$arrayElemAt": ["$_agent.name", 0]}, "$_id"]}}}
+        ]
+    
+    async def lead_facets():
+        cursor = await db.leads.aggregate([{"$match": base_query}, {"$facet": facets}])
+        return await cursor.to_list(1)
+    
+    facet_results, appointments_today = await asyncio.gather(
+        lead_facets(),
+        db.appointments.count_documents(apt_query)
     )
+    stats = facet_results[0]
+    
+    total_leads = stats["total"][0]["n"] if stats["total"] else 0
+    new_leads_today = stats["today"][0]["n"] if stats["today"] else 0
+    leads_by_status = {r["_id"]: r["count"] for r in stats["by_status"]}
+    leads_by_source = {r["_id"]: r["count"] for r in stats["by_source"]}
+    leads_by_career = {r["_id"]: r["count"] for r in stats["by_career"]}
+    leads_by_agent = {r["name"]: r["count"] for r in stats.get("by_agent", [])}
+    
+    # Conversion rate (etapa_4_inscrito / total)
+    converted = leads_by_status.get("etapa_4_inscrito", 0)
+    conversion_rate = (converted / total_leads * 100) if total_leads > 0 else 0
+    
+    return {
+        "total_leads": total_leads,
+        "leads_by_status": leads_by_status,
+        "leads_by_source": leads_by_source,
+        "leads_by_career": leads_by_career,
+        "leads_by_agent": leads_by_agent,
+        "conversion_rate": round(conversion_rate, 2),
+        "new_leads_today": new_leads_today,
+        "appointments_today": appointments_today,
+        "refreshed_at": datetime.now(timezone.utc)
+    }
+
+
+async def refresh_dashboard_snapshot() -> dict:
+    """Recompute the global stats and store them in dashboard_snapshots"""
+    stats = await _compute_stats()
+    # Breakdown keys are free-form values (career names with dots, null sources),
+    # so the breakdowns are stored as [key, count] pairs rather than subdocuments
+    snapshot = {k: list(v.items()) if isinstance(v, dict) else v for k, v in stats.items()}
+    await db.dashboard_snapshots.update_one({"scope": "global"}, {"$set": snapshot}, upsert=True)
+    return stats
+
+
+async def dashboard_snapshot_loop():
+    """Refresh the global snapshot every DASHBOARD_SNAPSHOT_INTERVAL seconds (started at startup)"""
+    while True:
+        try:
+            await refresh_dashboard_snapshot()
+        except Exception as e:
+            logger.warning(f"Dashboard snapshot refresh failed: {e}")
+        await asyncio.sleep(DASHBOARD_SNAPSHOT_INTERVAL)
+
+
+@router.get("/stats", response_model=DashboardStats)
+async def get_dashboard_stats(request: Request):
+    current_user = await get_current_user(request)
+    
+    # Agent-scoped stats only touch that agent's leads (assigned_agent_id index), so compute them live
+    if current_user["role"] == "agente":
+        return DashboardStats(**await _compute_stats(current_user["user_id"]))
+    
+    snapshot = await db.dashboard_snapshots.find_one({"scope": "global"}, {"_id": 0, "scope": 0})
+    if snapshot:
+        stats = {k: dict(v) if isinstance(v, list) else v for k, v in snapshot.items()}
+    else:
+        stats = await refresh_dashboard_snapshot()
+    
+    # The per-agent breakdown is only for admin/gerente
+    if current_user["role"] not in ("admin", "gerente"):
+        stats = {**stats, "leads_by_agent": {}}
+    
+    return DashboardStats(**stats)
 
 
 @router.get("/careers")
 async def get_career_options(request: Request):
     """Get list of careers for dropdowns"""
     await get_current_user(request)
-    
-    # First check if there are custom careers
-    careers_doc = await db.settings.find_one({"type": "careers"}, {"_id": 0})
+    return {"careers": await get_career_options_cached("dashboard", _load_career_options)}
+
+
+async def _load_career_options():
+    # Both sources are read in parallel; custom careers in settings take precedence
+    careers_doc, careers = await asyncio.gather(
+        db.settings.find_one({"type": "careers"}, {"_id": 0, "items": 1}),
+        db.careers_full.find({"is_active": True}, {"_id": 0, "name": 1}).to_list(1000)
+    )
     
     if careers_doc and careers_doc.get("items"):
-        return {"careers": careers_doc["items"]}
+        return careers_doc["items"]
     
     # Fall back to careers from careers_full collection
-    careers = await db.careers_full.find({"is_active": True}, {"_id": 0, "name": 1}).to_list(1000)
     career_names = [c["name"] for c in careers]
     
     if career_names:
-        return {"careers": career_names}
+        return career_names
     
     # Fall back to default careers
-    import sys; sys.path.insert(0, "/app/backend"); from config import DEFAULT_CAREERS
-    return {"careers": DEFAULT_CAREERS}
+    return list(DEFAULT_CAREERS)
 
 
 @router.get("/sources")
 async def get_source_options(request: Request):
     """Get list of lead sources for dropdowns"""
     await get_current_user(request)
-    import sys; sys.path.insert(0, "/app/backend"); from config import LEAD_SOURCES
-    return {"sources": LEAD_SOURCES}
+    return _SOURCE_OPTIONS
 
 
 @router.get("/statuses")
 async def get_status_options(request: Request):
     """Get list of lead statuses for dropdowns"""
     await get_current_user(request)
-    import sys; sys.path.insert(0, "/app/backend"); from config import LEAD_STATUSES
-    return {"statuses": LEAD_STATUSES}
+    return _STATUS_OPTIONS
 
 
 @router.get("/recent-leads")
@@ -147,7 +200,7 @@ async def get_recent_leads(request: Request, limit: int = 5):
     
     # Get agent names
     agent_ids = list(set([l.get("assigned_agent_id") for l in leads if l.get("assigned_agent_id")]))
-    agents = await db.users.find({"user_id": {"$in": agent_ids}}, {"_id": 0}).to_list(1000)
+    agents = await db.users.find({"user_id": {"$in": agent_ids}}, {"_id": 0, "user_id": 1, "name": 1}).to_list(1000)
     agent_map = {a["user_id"]: a["name"] for a in agents}
     
     # Add agent names to leads
@@ -1,42 +1,90 @@
 """Student management routes"""
+import asyncio
 import uuid
-import io
 import shutil
+import aiofiles
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from cachetools import TTLCache
 from fastapi import APIRouter, HTTPException, Request, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import TypeAdapter
+from pymongo import ReturnDocument, UpdateOne
 from typing import List, Optional
 from datetime import datetime, timezone
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger, STUDENT_DOCUMENTS_PATH
+from config import db, logger, STUDENT_DOCUMENTS_PATH
 from models.students import StudentCreate, StudentUpdate, StudentResponse, ConvertLeadToStudent
 from utils.auth import get_current_user, require_roles
-from utils.helpers import create_audit_log
+from utils.helpers import (
+    build_audit_log, create_audit_log, schedule_audit_log, run_in_background,
+    generate_institutional_email, insert_student
+)
 
 router = APIRouter(prefix="/students", tags=["students"])
 
+_STUDENT_LIST_ADAPTER = TypeAdapter(List[StudentResponse])
+
+CUSTOM_FIELD_EDITABLE_KEYS = frozenset({
+    "field_name", "field_type", "options", "required", "visible_to_students", "editable_by_supervisor", "order"
+})
+
+MAX_DOCUMENT_SIZE = 20 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+DOCUMENT_CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "doc": "application/msword",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif"
+}
+
+# (student_id, document_id) -> (path, original filename, media type) for downloads;
+# delete_document drops its entry
+_document_meta_cache = TTLCache(maxsize=10000, ttl=300)
+
+# Custom field definitions change rarely (admin edits) but are read by every
+# export and custom-field update; the create/update/delete routes clear this
+_custom_fields_cache = TTLCache(maxsize=1, ttl=30)
+
+
+async def get_custom_fields_cached() -> List[dict]:
+    """Return all custom field definitions ordered by "order" (cached for a short time)"""
+    fields = _custom_fields_cache.get("fields")
+    if fields is None:
+        fields = await db.custom_fields.find({}, {"_id": 0}).sort("order", 1).to_list(1000)
+        _custom_fields_cache["fields"] = fields
+    return fields
+
+
+def invalidate_custom_fields():
+    _custom_fields_cache.clear()
 
-def generate_institutional_email(full_name: str) -> str:
-    """Generate an institutional email from student name"""
-    parts = full_name.lower().strip().split()
-    if len(parts) >= 2:
-        email_base = f"{parts[0]}.{parts[-1]}"
-    else:
-        email_base = parts[0] if parts else "estudiante"
-    
-    # Remove accents and special characters
-    import unicodedata
-    email_base = unicodedata.normalize('NFKD', email_base).encode('ASCII', 'ignore').decode()
-    email_base = ''.join(c for c in email_base if c.isalnum() or c == '.')
-    
-    return f"{email_base}@ucic.edu.mx"
+
+# Exports only read these scalars plus custom_fields; skip attendance/documents arrays
+_STUDENT_EXPORT_PROJECTION = {
+    "_id": 0, "student_id": 1, "full_name": 1, "email": 1, "phone": 1, "career_name": 1,
+    "institutional_email": 1, "created_at": 1, "custom_fields": 1
+}
+# Fields declared on StudentResponse
+_STUDENT_RESPONSE_PROJECTION = {
+    "_id": 0, "student_id": 1, "full_name": 1, "email": 1, "phone": 1, "career_id": 1, "career_name": 1,
+    "institutional_email": 1, "lead_id": 1, "documents": 1, "attendance": 1, "custom_fields": 1,
+    "is_active": 1, "created_at": 1
+}
 
 
 @router.post("", response_model=StudentResponse)
@@ -47,20 +95,15 @@ async def create_student(student_data: StudentCreate, request: Request):
     student_id = f"student_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc)
     
-    # Generate institutional email if not provided
+    # Generate institutional email if not provided (collisions are resolved on insert)
     institutional_email = student_data.institutional_email
-    if not institutional_email:
+    generated_email = not institutional_email
+    if generated_email:
         institutional_email = generate_institutional_email(student_data.full_name)
-        # Check for duplicates and add number if needed
-        base_email = institutional_email.replace("@ucic.edu.mx", "")
-        counter = 1
-        while await db.students.find_one({"institutional_email": institutional_email}, {"_id": 0}):
-            institutional_email = f"{base_email}{counter}@ucic.edu.mx"
-            counter += 1
     
     # Create document folder for student
     student_folder = STUDENT_DOCUMENTS_PATH / student_id
-    student_folder.mkdir(exist_ok=True)
+    await asyncio.to_thread(student_folder.mkdir, exist_ok=True)
     
     student = {
         "student_id": student_id,
@@ -75,12 +118,11 @@ async def create_student(student_data: StudentCreate, request: Request):
         "attendance": [],
         "custom_fields": {},
         "is_active": True,
-        "created_at": now.isoformat(),
-        "updated_at": now.isoformat()
+        "created_at": now,
+        "updated_at": now
     }
     
-    await db.students.insert_one(student)
-    student.pop("_id", None)
+    await insert_student(student, generated_email)
     
     logger.info(f"Student created: {student_id}")
     return StudentResponse(**student)
@@ -92,8 +134,8 @@ async def get_custom_fields(request: Request):
     """Get all custom field definitions"""
     await get_current_user(request)
     
-    fields = await db.custom_fields.find({}, {"_id": 0}).sort("order", 1).to_list(100)
-    return {"fields": fields}
+    fields = await get_custom_fields_cached()
+    return ORJSONResponse({"fields": fields})
 
 
 @router.post("/custom-fields")
@@ -118,14 +160,15 @@ async def create_custom_field(request: Request):
         "visible_to_students": body.get("visible_to_students", True),
         "editable_by_supervisor": body.get("editable_by_supervisor", True),
         "order": next_order,
-        "created_at": now.isoformat(),
+        "created_at": now,
         "created_by": current_user["user_id"]
     }
     
     await db.custom_fields.insert_one(field)
     field.pop("_id", None)
+    invalidate_custom_fields()
     
-    await create_audit_log(
+    schedule_audit_log(
         entity_type="custom_field",
         entity_id=field_id,
         action="create",
@@ -147,12 +190,13 @@ async def update_custom_field(field_id: str, request: Request):
     if not field:
         raise HTTPException(status_code=404, detail="Campo no encontrado")
     
-    update_data = {k: v for k, v in body.items() if k in ["field_name", "field_type", "options", "required", "visible_to_students", "editable_by_supervisor", "order"]}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data = {k: v for k, v in body.items() if k in CUSTOM_FIELD_EDITABLE_KEYS}
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
     await db.custom_fields.update_one({"field_id": field_id}, {"$set": update_data})
+    invalidate_custom_fields()
     
-    await create_audit_log(
+    schedule_audit_log(
         entity_type="custom_field",
         entity_id=field_id,
         action="update",
@@ -173,6 +217,7 @@ async def delete_custom_field(field_id: str, request: Request):
     result = await db.custom_fields.delete_one({"field_id": field_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Campo no encontrado")
+    invalidate_custom_fields()
     
     # Remove field values from all students
     await db.students.update_many({}, {"$unset": {f"custom_fields.{field_id}": ""}})
@@ -190,16 +235,39 @@ async def delete_custom_field(field_id: str, request: Request):
 
 # Change requests (approval workflow)
 @router.get("/change-requests")
-async def get_change_requests(request: Request, status: Optional[str] = None):
-    """Get all change requests (for approval)"""
+async def get_change_requests(request: Request, status: Optional[str] = None, skip: int = 0, limit: int = 100):
+    """Get change requests (for approval), newest first, one page at a time"""
     await require_roles(["admin", "gerente"])(request)
     
+    skip, limit = max(0, skip), max(1, min(limit, 500))
     query = {}
     if status:
         query["status"] = status
     
-    requests_list = await db.change_requests.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return {"requests": requests_list}
+    requests_list = await db.change_requests.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    return ORJSONResponse({"requests": requests_list, "skip": skip, "limit": limit})
+
+
+async def _claim_change_request(request_id: str, status: str, current_user: dict) -> dict:
+    """Atomically move a pending change request to status; returns it as it was before"""
+    change_req = await db.change_requests.find_one_and_update(
+        {"request_id": request_id, "status": "pending"},
+        {"$set": {
+            "status": status,
+            "approved_by_id": current_user["user_id"],
+            "approved_by_name": current_user["name"],
+            "resolved_at": datetime.now(timezone.utc)
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if change_req:
+        return change_req
+    
+    # Only the miss path needs to tell a missing request from an already processed one
+    if not await db.change_requests.find_one({"request_id": request_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+    raise HTTPException(status_code=400, detail="La solicitud ya fue procesada")
 
 
 @router.post("/change-requests/{request_id}/approve")
@@ -207,39 +275,10 @@ async def approve_change_request(request_id: str, request: Request):
     """Approve a change request"""
     current_user = await require_roles(["admin", "gerente"])(request)
     
-    change_req = await db.change_requests.find_one({"request_id": request_id}, {"_id": 0})
-    if not change_req:
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
-    
-    if change_req["status"] != "pending":
-        raise HTTPException(status_code=400, detail="La solicitud ya fue procesada")
-    
-    now = datetime.now(timezone.utc)
-    
-    # Apply the change
-    student = await db.students.find_one({"student_id": change_req["student_id"]}, {"_id": 0})
-    if student:
-        custom_fields = student.get("custom_fields", {})
-        custom_fields[change_req["field_id"]] = change_req["new_value"]
-        
-        await db.students.update_one(
-            {"student_id": change_req["student_id"]},
-            {"$set": {"custom_fields": custom_fields, "updated_at": now.isoformat()}}
-        )
-    
-    # Update request status
-    await db.change_requests.update_one(
-        {"request_id": request_id},
-        {"$set": {
-            "status": "approved",
-            "approved_by_id": current_user["user_id"],
-            "approved_by_name": current_user["name"],
-            "resolved_at": now.isoformat()
-        }}
-    )
+    change_req = await _claim_change_request(request_id, "approved", current_user)
     
-    # Create audit log
-    await create_audit_log(
+    # Apply the change; the audit log is written in the background
+    schedule_audit_log(
         entity_type="student",
         entity_id=change_req["student_id"],
         action="approve",
@@ -250,6 +289,13 @@ async def approve_change_request(request_id: str, request: Request):
         authorized_by=current_user,
         request=request
     )
+    await db.students.update_one(
+        {"student_id": change_req["student_id"]},
+        {"$set": {
+            f"custom_fields.{change_req['field_id']}": change_req["new_value"],
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
     
     return {"message": "Cambio aprobado"}
 
@@ -259,26 +305,9 @@ async def reject_change_request(request_id: str, request: Request):
     """Reject a change request"""
     current_user = await require_roles(["admin", "gerente"])(request)
     
-    change_req = await db.change_requests.find_one({"request_id": request_id}, {"_id": 0})
-    if not change_req:
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada")
-    
-    if change_req["status"] != "pending":
-        raise HTTPException(status_code=400, detail="La solicitud ya fue procesada")
-    
-    now = datetime.now(timezone.utc)
-    
-    await db.change_requests.update_one(
-        {"request_id": request_id},
-        {"$set": {
-            "status": "rejected",
-            "approved_by_id": current_user["user_id"],
-            "approved_by_name": current_user["name"],
-            "resolved_at": now.isoformat()
-        }}
-    )
+    await _claim_change_request(request_id, "rejected", current_user)
     
-    await create_audit_log(
+    schedule_audit_log(
         entity_type="change_request",
         entity_id=request_id,
         action="reject",
@@ -291,107 +320,171 @@ async def reject_change_request(request_id: str, request: Request):
 
 # Audit logs
 @router.get("/audit-logs")
-async def get_audit_logs(request: Request, entity_type: Optional[str] = None, entity_id: Optional[str] = None):
-    """Get audit logs"""
+async def get_audit_logs(
+    request: Request,
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100
+):
+    """Get audit logs, newest first, one page at a time"""
     await require_roles(["admin", "gerente"])(request)
     
+    skip, limit = max(0, skip), max(1, min(limit, 500))
     query = {}
     if entity_type:
         query["entity_type"] = entity_type
     if entity_id:
         query["entity_id"] = entity_id
     
-    logs = await db.audit_logs.find(query, {"_id": 0}).sort("timestamp", -1).to_list(1000)
-    return {"logs": logs}
+    logs = await db.audit_logs.find(query, {"_id": 0}).sort("timestamp", -1).skip(skip).limit(limit).to_list(limit)
+    return ORJSONResponse({"logs": logs, "skip": skip, "limit": limit})
 
 
 # Export endpoints
-@router.get("/export/excel")
-async def export_students_excel(request: Request):
-    """Export students to Excel"""
-    await require_roles(["admin", "gerente"])(request)
-    
-    students = await db.students.find({}, {"_id": 0}).to_list(10000)
-    custom_fields = await db.custom_fields.find({}, {"_id": 0}).sort("order", 1).to_list(100)
-    
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Estudiantes"
+# Exports are rendered into a spooled temp file (in memory up to EXPORT_SPOOL_SIZE,
+# then on disk) and streamed out in chunks, so a large export doesn't pin its
+# whole file in RAM for the lifetime of the response
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_export(output: SpooledTemporaryFile):
+    """Yield a rendered export in chunks and close it (Starlette iterates this in a thread)"""
+    try:
+        output.seek(0)
+        while chunk := output.read(EXPORT_CHUNK_SIZE):
+            yield chunk
+    finally:
+        output.close()
+
+
+def _build_xlsx(students: List[dict], custom_fields: List[dict], output: SpooledTemporaryFile):
+    """Render the students export workbook into output (blocking; run it in a thread)"""
+    # Write-only mode streams rows into the file instead of keeping a Cell object per value
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Estudiantes")
     
     # Headers
     headers = ["ID", "Nombre", "Email", "Teléfono", "Carrera", "Email Institucional", "Fecha Inscripción"]
     for field in custom_fields:
         headers.append(field["field_name"])
     
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = cell.font.copy(bold=True)
-    
-    # Data rows
-    for row_num, student in enumerate(students, 2):
-        ws.cell(row=row_num, column=1, value=student.get("student_id", ""))
-        ws.cell(row=row_num, column=2, value=student.get("full_name", ""))
-        ws.cell(row=row_num, column=3, value=student.get("email", ""))
-        ws.cell(row=row_num, column=4, value=student.get("phone", ""))
-        ws.cell(row=row_num, column=5, value=student.get("career_name", ""))
-        ws.cell(row=row_num, column=6, value=student.get("institutional_email", ""))
-        ws.cell(row=row_num, column=7, value=student.get("created_at", "")[:10] if student.get("created_at") else "")
+    # Data rows; the longest value per column is tracked while the rows are built
+    col_max_len = [len(header) for header in headers]
+    rows = []
+    for student in students:
+        row = [
+            student.get("student_id", ""),
+            student.get("full_name", ""),
+            student.get("email", ""),
+            student.get("phone", ""),
+            student.get("career_name", ""),
+            student.get("institutional_email", ""),
+            str(student["created_at"])[:10] if student.get("created_at") else ""
+        ]
         
         custom_values = student.get("custom_fields", {})
-        for col_offset, field in enumerate(custom_fields, 8):
+        for field in custom_fields:
             value = custom_values.get(field["field_id"], "")
-            ws.cell(row=row_num, column=col_offset, value=str(value) if value is not None else "")
-    
-    # Adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    output = io.BytesIO()
+            row.append(str(value) if value is not None else "")
+        rows.append(row)
+        col_max_len = [max(current, len(str(value))) for current, value in zip(col_max_len, row)]
+    
+    # Adjust column widths (a write-only sheet needs them before the first row is written)
+    for col, max_length in enumerate(col_max_len, 1):
+        ws.column_dimensions[get_column_letter(col)].width = min(max_length + 2, 50)
+    
+    header_font = Font(bold=True)
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = header_font
+        header_cells.append(cell)
+    ws.append(header_cells)
+    
+    for row in rows:
+        ws.append(row)
+    
     wb.save(output)
-    output.seek(0)
+
+
+@router.get("/export/excel")
+async def export_students_excel(request: Request):
+    """Export students to Excel"""
+    await require_roles(["admin", "gerente"])(request)
+    
+    students = await db.students.find({}, _STUDENT_EXPORT_PROJECTION).to_list(10000)
+    custom_fields = await get_custom_fields_cached()
+    
+    # openpyxl is CPU-bound; building the file on the event loop would stall every other request
+    output = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        await asyncio.to_thread(_build_xlsx, students, custom_fields, output)
+    except BaseException:
+        output.close()
+        raise
     
     filename = f"estudiantes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     
     return StreamingResponse(
-        output,
+        _iter_export(output),
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 
-@router.get("/export/pdf")
-async def export_students_pdf(request: Request):
-    """Export students to PDF"""
-    await require_roles(["admin", "gerente"])(request)
-    
-    students = await db.students.find({}, {"_id": 0}).to_list(10000)
-    custom_fields = await db.custom_fields.find({}, {"_id": 0}).sort("order", 1).to_list(100)
-    
-    output = io.BytesIO()
+# PDF export styles are fixed, so they are built once and shared by every export
+_PDF_STYLES = getSampleStyleSheet()
+_PDF_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_PDF_STYLES['Heading1'],
+    fontSize=18,
+    spaceAfter=20,
+    alignment=1
+)
+_PDF_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e293b')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('TOPPADDING', (0, 0), (-1, 0), 8),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8fafc')])
+])
+_PDF_BASE_COL_WIDTHS = [1.5*inch, 1.8*inch, 1.2*inch, 1.5*inch, 1.5*inch]
+# (student key, max characters) for the fixed PDF columns
+_PDF_COLUMNS = (
+    ("full_name", 25),
+    ("email", 25),
+    ("phone", 15),
+    ("career_name", 20),
+    ("institutional_email", 20)
+)
+
+
+def _pdf_row(student: dict, field_ids: List[str]) -> List[str]:
+    """One PDF table row: the truncated fixed columns followed by the custom fields"""
+    custom_values = student.get("custom_fields") or {}
+    return (
+        [str(student.get(key) or "")[:max_len] for key, max_len in _PDF_COLUMNS]
+        + [str(custom_values.get(field_id, ""))[:15] for field_id in field_ids]
+    )
+
+
+def _build_pdf(students: List[dict], custom_fields: List[dict], generated_at: datetime, output: SpooledTemporaryFile):
+    """Render the students export PDF into output (blocking; run it in a thread)"""
     doc = SimpleDocTemplate(output, pagesize=landscape(letter), topMargin=0.5*inch, bottomMargin=0.5*inch)
     
     elements = []
-    styles = getSampleStyleSheet()
     
     # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=20,
-        alignment=1
-    )
-    elements.append(Paragraph("UCIC - Lista de Estudiantes", title_style))
-    elements.append(Paragraph(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal']))
+    elements.append(Paragraph("UCIC - Lista de Estudiantes", _PDF_TITLE_STYLE))
+    elements.append(Paragraph(f"Generado: {generated_at.strftime('%d/%m/%Y %H:%M')}", _PDF_STYLES['Normal']))
     elements.append(Spacer(1, 20))
     
     # Table headers
@@ -401,67 +494,65 @@ async def export_students_pdf(request: Request):
         headers.append(field["field_name"][:15])
     
     # Table data
-    data = [headers]
-    for student in students:
-        row = [
-            student.get("full_name", "")[:25],
-            student.get("email", "")[:25],
-            student.get("phone", "")[:15],
-            student.get("career_name", "")[:20],
-            (student.get("institutional_email", "") or "")[:20]
-        ]
-        
-        custom_values = student.get("custom_fields", {})
-        for field in custom_fields[:3]:
-            val = str(custom_values.get(field["field_id"], ""))[:15]
-            row.append(val)
-        
-        data.append(row)
+    pdf_field_ids = [field["field_id"] for field in custom_fields[:3]]
+    data = [headers] + [_pdf_row(student, pdf_field_ids) for student in students]
     
     # Create table
-    col_widths = [1.5*inch, 1.8*inch, 1.2*inch, 1.5*inch, 1.5*inch]
-    col_widths.extend([1*inch] * min(len(custom_fields), 3))
+    col_widths = _PDF_BASE_COL_WIDTHS + [1*inch] * min(len(custom_fields), 3)
     
     table = Table(data, colWidths=col_widths)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e293b')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 9),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('TOPPADDING', (0, 0), (-1, 0), 8),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8fafc')])
-    ]))
+    table.setStyle(_PDF_TABLE_STYLE)
     
     elements.append(table)
     
     # Footer
     elements.append(Spacer(1, 20))
-    elements.append(Paragraph(f"Total: {len(students)} estudiantes", styles['Normal']))
+    elements.append(Paragraph(f"Total: {len(students)} estudiantes", _PDF_STYLES['Normal']))
     
     doc.build(elements)
-    output.seek(0)
+
+
+@router.get("/export/pdf")
+async def export_students_pdf(request: Request):
+    """Export students to PDF"""
+    await require_roles(["admin", "gerente"])(request)
+    
+    students = await db.students.find({}, _STUDENT_EXPORT_PROJECTION).to_list(10000)
+    custom_fields = await get_custom_fields_cached()
+    
+    # The header timestamp and the filename share one clock reading
+    generated_at = datetime.now()
+    output = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    try:
+        await asyncio.to_thread(_build_pdf, students, custom_fields, generated_at, output)
+    except BaseException:
+        output.close()
+        raise
     
-    filename = f"estudiantes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    filename = f"estudiantes_{generated_at.strftime('%Y%m%d_%H%M%S')}.pdf"
     
     return StreamingResponse(
-        output,
+        _iter_export(output),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
 
 @router.get("", response_model=List[StudentResponse])
-async def get_students(request: Request):
-    """Get all students"""
+async def get_students(request: Request, skip: int = 0, limit: int = 1000):
+    """Get students, newest first, one page at a time"""
     await get_current_user(request)
     
-    students = await db.students.find({}, {"_id": 0}).to_list(1000)
-    return [StudentResponse(**s) for s in students]
+    skip, limit = max(0, skip), max(1, min(limit, 1000))
+    students = await db.students.find({}, _STUDENT_RESPONSE_PROJECTION).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    
+    # Documents come from our own collection, so skip per-row validation and
+    # serialize the whole list in one pass instead of going through response_model
+    construct = StudentResponse.model_construct
+    return Response(
+        content=_STUDENT_LIST_ADAPTER.dump_json([construct(**s) for s in students], warnings=False),
+        media_type="application/json"
+    )
 
 
 @router.get("/{student_id}", response_model=StudentResponse)
@@ -481,16 +572,19 @@ async def update_student(student_id: str, student_data: StudentUpdate, request:
     """Update a student"""
     await require_roles(["admin", "gerente"])(request)
     
-    student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
-    if not student:
-        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
-    
     update_data = {k: v for k, v in student_data.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.students.update_one({"student_id": student_id}, {"$set": update_data})
+    # Update and read back the new document atomically
+    updated_student = await db.students.find_one_and_update(
+        {"student_id": student_id},
+        {"$set": update_data},
+        projection=_STUDENT_RESPONSE_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_student:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
-    updated_student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
     return StudentResponse(**updated_student)
 
 
@@ -509,11 +603,28 @@ async def delete_student(student_id: str, request: Request):
         shutil.rmtree(student_folder)
     
     await db.students.delete_one({"student_id": student_id})
+    for key in [k for k in _document_meta_cache if k[0] == student_id]:
+        _document_meta_cache.pop(key, None)
     
     return {"message": "Estudiante eliminado"}
 
 
 # Document management
+async def _find_student_document(student_id: str, document_id: str) -> dict:
+    """Fetch one entry of a student's documents array (positional projection), or 404"""
+    student = await db.students.find_one(
+        {"student_id": student_id, "documents.document_id": document_id},
+        {"_id": 0, "documents.$": 1}
+    )
+    if student and student.get("documents"):
+        return student["documents"][0]
+    
+    # Only the miss path needs to tell a missing student from a missing document
+    if not await db.students.find_one({"student_id": student_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    raise HTTPException(status_code=404, detail="Documento no encontrado")
+
+
 @router.post("/{student_id}/documents")
 async def upload_document(
     student_id: str,
@@ -524,13 +635,16 @@ async def upload_document(
     """Upload a document for a student"""
     await require_roles(["admin", "gerente", "supervisor"])(request)
     
+    if file.size is not None and file.size > MAX_DOCUMENT_SIZE:
+        raise HTTPException(status_code=413, detail="El archivo excede el tamaño máximo de 20 MB")
+    
     student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
     if not student:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
     # Create student folder if not exists
     student_folder = STUDENT_DOCUMENTS_PATH / student_id
-    student_folder.mkdir(exist_ok=True)
+    await asyncio.to_thread(student_folder.mkdir, exist_ok=True)
     
     # Generate unique filename
     document_id = f"doc_{uuid.uuid4().hex[:8]}"
@@ -538,10 +652,18 @@ async def upload_document(
     safe_filename = f"{document_id}{file_extension}"
     file_path = student_folder / safe_filename
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+    # Save file in chunks so large uploads never sit in memory or block the event loop;
+    # file.size is client-declared, so enforce the limit on the bytes actually received
+    written = 0
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            written += len(chunk)
+            if written > MAX_DOCUMENT_SIZE:
+                break
+            await buffer.write(chunk)
+    if written > MAX_DOCUMENT_SIZE:
+        await asyncio.to_thread(file_path.unlink, missing_ok=True)
+        raise HTTPException(status_code=413, detail="El archivo excede el tamaño máximo de 20 MB")
     
     # Add document reference to student
     document = {
@@ -549,7 +671,7 @@ async def upload_document(
         "name": document_type,
         "filename": safe_filename,
         "original_filename": file.filename,
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
+        "uploaded_at": datetime.now(timezone.utc)
     }
     
     await db.students.update_one(
@@ -565,19 +687,7 @@ async def delete_document(student_id: str, document_id: str, request: Request):
     """Delete a document"""
     await require_roles(["admin", "gerente"])(request)
     
-    student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
-    if not student:
-        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
-    
-    # Find document
-    document = None
-    for doc in student.get("documents", []):
-        if doc["document_id"] == document_id:
-            document = doc
-            break
-    
-    if not document:
-        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    document = await _find_student_document(student_id, document_id)
     
     # Delete file
     file_path = STUDENT_DOCUMENTS_PATH / student_id / document["filename"]
@@ -589,6 +699,7 @@ async def delete_document(student_id: str, document_id: str, request: Request):
         {"student_id": student_id},
         {"$pull": {"documents": {"document_id": document_id}}}
     )
+    _document_meta_cache.pop((student_id, document_id), None)
     
     return {"message": "Documento eliminado"}
 
@@ -596,51 +707,78 @@ async def delete_document(student_id: str, document_id: str, request: Request):
 @router.get("/{student_id}/documents/{document_id}/download")
 async def download_document(student_id: str, document_id: str, request: Request):
     """Download a document"""
-    from fastapi.responses import FileResponse
-    
     await get_current_user(request)
     
-    student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
-    if not student:
-        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
-    
-    # Find document
-    document = None
-    for doc in student.get("documents", []):
-        if doc["document_id"] == document_id:
-            document = doc
-            break
-    
-    if not document:
-        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    meta = _document_meta_cache.get((student_id, document_id))
+    if meta is None:
+        document = await _find_student_document(student_id, document_id)
+        
+        # Determine content type based on file extension
+        extension = document["filename"].lower().split(".")[-1] if "." in document["filename"] else ""
+        meta = (
+            STUDENT_DOCUMENTS_PATH / student_id / document["filename"],
+            document.get("original_filename", document["filename"]),
+            DOCUMENT_CONTENT_TYPES.get(extension, "application/octet-stream")
+        )
+        _document_meta_cache[(student_id, document_id)] = meta
     
-    file_path = STUDENT_DOCUMENTS_PATH / student_id / document["filename"]
-    if not file_path.exists():
+    file_path, original_filename, media_type = meta
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
     
-    # Determine content type based on file extension
-    extension = document["filename"].lower().split(".")[-1] if "." in document["filename"] else ""
-    content_types = {
-        "pdf": "application/pdf",
-        "doc": "application/msword",
-        "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "gif": "image/gif"
-    }
-    media_type = content_types.get(extension, "application/octet-stream")
-    
-    original_filename = document.get("original_filename", document["filename"])
+    # Uploaded files are never rewritten in place, so mtime+size identify the content
+    etag = f'W/"{int(stat.st_mtime)}-{stat.st_size}"'
+    headers = {"Cache-Control": "private, max-age=3600", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
     
     return FileResponse(
         path=str(file_path),
         media_type=media_type,
-        filename=original_filename
+        filename=original_filename,
+        headers=headers,
+        stat_result=stat
     )
 
 
 # Attendance management
+def _attendance_record(body: dict, today: str) -> dict:
+    return {
+        "date": body.get("date", today),
+        "subject": body.get("subject", ""),
+        "teacher_id": body.get("teacher_id"),
+        "teacher_name": body.get("teacher_name"),
+        "status": body.get("status", "presente"),
+        "notes": body.get("notes")
+    }
+
+
+@router.post("/attendance/bulk")
+async def record_attendance_bulk_multi(request: Request):
+    """Record attendance for several students in one batch (e.g. imports)"""
+    await require_roles(["admin", "gerente", "supervisor", "maestro"])(request)
+    
+    body = await request.json()
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    
+    # Group records per student so each student gets a single $push/$each
+    by_student = {}
+    for item in body.get("records", []):
+        if item.get("student_id"):
+            by_student.setdefault(item["student_id"], []).append(_attendance_record(item, today))
+    if not by_student:
+        raise HTTPException(status_code=400, detail="No se enviaron registros de asistencia")
+    
+    result = await db.students.bulk_write([
+        UpdateOne({"student_id": sid}, {"$push": {"attendance": {"$each": records}}})
+        for sid, records in by_student.items()
+    ], ordered=False)
+    
+    return {"message": "Asistencia registrada", "students_updated": result.matched_count}
+
+
 @router.post("/{student_id}/attendance")
 async def record_attendance(student_id: str, request: Request):
     """Record attendance for a student"""
@@ -652,14 +790,7 @@ async def record_attendance(student_id: str, request: Request):
     if not student:
         raise HTTPException(status_code=404, detail="Estudiante no encontrado")
     
-    attendance_record = {
-        "date": body.get("date", datetime.now(timezone.utc).strftime("%Y-%m-%d")),
-        "subject": body.get("subject", ""),
-        "teacher_id": body.get("teacher_id"),
-        "teacher_name": body.get("teacher_name"),
-        "status": body.get("status", "presente"),
-        "notes": body.get("notes")
-    }
+    attendance_record = _attendance_record(body, datetime.now(timezone.utc).strftime("%Y-%m-%d"))
     
     await db.students.update_one(
         {"student_id": student_id},
@@ -669,6 +800,27 @@ async def record_attendance(student_id: str, request: Request):
     return {"message": "Asistencia registrada"}
 
 
+@router.post("/{student_id}/attendance/bulk")
+async def record_attendance_bulk(student_id: str, request: Request):
+    """Record several attendance entries for a student in one write"""
+    await require_roles(["admin", "gerente", "supervisor", "maestro"])(request)
+    
+    body = await request.json()
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    records = [_attendance_record(item, today) for item in body.get("records", [])]
+    if not records:
+        raise HTTPException(status_code=400, detail="No se enviaron registros de asistencia")
+    
+    result = await db.students.update_one(
+        {"student_id": student_id},
+        {"$push": {"attendance": {"$each": records}}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    
+    return {"message": "Asistencia registrada", "count": len(records)}
+
+
 @router.put("/{student_id}/custom-fields")
 async def update_student_custom_fields(student_id: str, request: Request):
     """Update custom field values for a student"""
@@ -686,13 +838,17 @@ async def update_student_custom_fields(student_id: str, request: Request):
     if user_role == "alumno":
         raise HTTPException(status_code=403, detail="Los alumnos no pueden modificar datos")
     
+    changes = body.get("fields", {})
+    old_custom_fields = student.get("custom_fields", {})
+    
+    field_defs = {f["field_id"]: f for f in await get_custom_fields_cached()}
+    now = datetime.now(timezone.utc)
+    
     # Supervisors need approval for changes
     if user_role == "supervisor":
-        changes = body.get("fields", {})
-        old_custom_fields = student.get("custom_fields", {})
-        
+        pending_requests = []
         for field_id, new_value in changes.items():
-            field_def = await db.custom_fields.find_one({"field_id": field_id}, {"_id": 0})
+            field_def = field_defs.get(field_id)
             if not field_def:
                 continue
                 
@@ -702,7 +858,6 @@ async def update_student_custom_fields(student_id: str, request: Request):
             old_value = old_custom_fields.get(field_id)
             if old_value != new_value:
                 request_id = f"req_{uuid.uuid4().hex[:8]}"
-                now = datetime.now(timezone.utc)
                 
                 change_request = {
                     "request_id": request_id,
@@ -715,23 +870,24 @@ async def update_student_custom_fields(student_id: str, request: Request):
                     "requested_by_id": current_user["user_id"],
                     "requested_by_name": current_user["name"],
                     "status": "pending",
-                    "created_at": now.isoformat()
+                    "created_at": now
                 }
                 
-                await db.change_requests.insert_one(change_request)
+                pending_requests.append(change_request)
+        
+        if pending_requests:
+            await db.change_requests.insert_many(pending_requests, ordered=False)
         
         return {"message": "Solicitud de cambio enviada para aprobación", "requires_approval": True}
     
     # Admin/Gerente can update directly
-    changes = body.get("fields", {})
-    old_custom_fields = student.get("custom_fields", {})
-    
+    audit_entries = []
     for field_id, new_value in changes.items():
-        field_def = await db.custom_fields.find_one({"field_id": field_id}, {"_id": 0})
+        field_def = field_defs.get(field_id)
         if field_def:
             old_value = old_custom_fields.get(field_id)
             
-            await create_audit_log(
+            audit_entries.append(build_audit_log(
                 entity_type="student",
                 entity_id=student_id,
                 action="update",
@@ -740,11 +896,14 @@ async def update_student_custom_fields(student_id: str, request: Request):
                 new_value=new_value,
                 performed_by=current_user,
                 request=request
-            )
+            ))
+    
+    if audit_entries:
+        run_in_background(db.audit_logs.insert_many(audit_entries, ordered=False))
     
     await db.students.update_one(
         {"student_id": student_id},
-        {"$set": {"custom_fields": changes, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"custom_fields": changes, "updated_at": now}}
     )
     
     return {"message": "Campos actualizados"}
@@ -1,10 +1,12 @@
 """Teacher management routes"""
 import uuid
 from fastapi import APIRouter, HTTPException, Request
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import List
 from datetime import datetime, timezone
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger
+from config import db, logger
 from models.teachers import TeacherCreate, TeacherUpdate, TeacherResponse
 from utils.auth import get_current_user, require_roles
 
@@ -16,11 +18,6 @@ async def create_teacher(teacher_data: TeacherCreate, request: Request):
     """Create a new teacher"""
     await require_roles(["admin", "gerente"])(request)
     
-    # Check if email already exists
-    existing = await db.teachers.find_one({"email": teacher_data.email}, {"_id": 0})
-    if existing:
-        raise HTTPException(status_code=400, detail="El email ya está registrado")
-    
     teacher_id = f"teacher_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc)
     
@@ -31,11 +28,15 @@ async def create_teacher(teacher_data: TeacherCreate, request: Request):
         "phone": teacher_data.phone,
         "subjects": teacher_data.subjects,
         "is_active": True,
-        "created_at": now.isoformat(),
-        "updated_at": now.isoformat()
+        "created_at": now,
+        "updated_at": now
     }
     
-    await db.teachers.insert_one(teacher)
+    # The unique email index rejects duplicates atomically
+    try:
+        await db.teachers.insert_one(teacher)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="El email ya está registrado")
     teacher.pop("_id", None)
     
     logger.info(f"Teacher created: {teacher_id}")
@@ -43,11 +44,12 @@ async def create_teacher(teacher_data: TeacherCreate, request: Request):
 
 
 @router.get("", response_model=List[TeacherResponse])
-async def get_teachers(request: Request):
-    """Get all teachers"""
+async def get_teachers(request: Request, skip: int = 0, limit: int = 1000):
+    """Get teachers, paginated with skip/limit"""
     await get_current_user(request)
     
-    teachers = await db.teachers.find({}, {"_id": 0}).to_list(1000)
+    skip, limit = max(0, skip), max(1, min(limit, 1000))
+    teachers = await db.teachers.find({}, {"_id": 0}).sort("_id", 1).skip(skip).limit(limit).to_list(limit)
     return [TeacherResponse(**t) for t in teachers]
 
 
@@ -68,16 +70,18 @@ async def update_teacher(teacher_id: str, teacher_data: TeacherUpdate, request:
     """Update a teacher"""
     await require_roles(["admin", "gerente"])(request)
     
-    teacher = await db.teachers.find_one({"teacher_id": teacher_id}, {"_id": 0})
-    if not teacher:
-        raise HTTPException(status_code=404, detail="Maestro no encontrado")
-    
     update_data = {k: v for k, v in teacher_data.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_data["updated_at"] = datetime.now(timezone.utc)
     
-    await db.teachers.update_one({"teacher_id": teacher_id}, {"$set": update_data})
+    updated_teacher = await db.teachers.find_one_and_update(
+        {"teacher_id": teacher_id},
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_teacher:
+        raise HTTPException(status_code=404, detail="Maestro no encontrado")
     
-    updated_teacher = await db.teachers.find_one({"teacher_id": teacher_id}, {"_id": 0})
     return TeacherResponse(**updated_teacher)
 
 
@@ -1,110 +1,107 @@
 """User management routes"""
+import asyncio
 import uuid
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import TypeAdapter
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from typing import List
 from datetime import datetime, timezone
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger
+from config import db, logger
 from models.users import UserCreate, UserUpdate, UserResponse, AdminResetPasswordRequest
-from utils.auth import hash_password, get_current_user, require_roles
+from utils.auth import hash_password, get_current_user, require_roles, invalidate_cached_user
+from utils.helpers import invalidate_agent_name
 
 router = APIRouter(prefix="/users", tags=["users"])
 
+_USER_LIST_ADAPTER = TypeAdapter(List[UserResponse])
+# Fields declared on UserResponse (never password_hash)
+_USER_RESPONSE_PROJECTION = {
+    "_id": 0, "user_id": 1, "email": 1, "name": 1, "role": 1, "phone": 1,
+    "is_active": 1, "picture": 1, "assigned_careers": 1, "created_at": 1
+}
+
+
+# Listing shape normalized server-side: defaults for fields older documents
+# lack and a date for legacy string timestamps, so rows match UserResponse
+_USER_LIST_STAGE = {"$project": {
+    "_id": 0, "user_id": 1, "email": 1, "name": 1, "role": 1,
+    "phone": {"$ifNull": ["$phone", None]},
+    "is_active": {"$ifNull": ["$is_active", True]},
+    "picture": {"$ifNull": ["$picture", None]},
+    "assigned_careers": {"$ifNull": ["$assigned_careers", []]},
+    "created_at": {"$cond": [
+        {"$eq": [{"$type": "$created_at"}, "string"]},
+        {"$toDate": "$created_at"},
+        "$created_at"
+    ]}
+}}
+
+
+async def _list_users(match: dict, sort: dict, skip: int, limit: int) -> List[dict]:
+    cursor = await db.users.aggregate([
+        {"$match": match},
+        {"$sort": sort},
+        {"$skip": skip},
+        {"$limit": limit},
+        _USER_LIST_STAGE
+    ])
+    return await cursor.to_list(limit)
+
+
+def _user_list_response(users: List[dict]) -> Response:
+    # Rows are already shaped by _USER_LIST_STAGE, so skip per-row validation and
+    # serialize the whole list in one pass instead of going through response_model
+    construct = UserResponse.model_construct
+    return Response(
+        content=_USER_LIST_ADAPTER.dump_json([construct(**u) for u in users], warnings=False),
+        media_type="application/json"
+    )
+
 
 @router.get("", response_model=List[UserResponse])
-async def get_users(request: Request):
+async def get_users(request: Request, skip: int = 0, limit: int = 1000):
     await require_roles(["admin", "gerente"])(request)
     
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    result = []
-    for user in users:
-        created_at = user.get("created_at")
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        result.append(UserResponse(
-            user_id=user["user_id"],
-            email=user["email"],
-            name=user["name"],
-            role=user["role"],
-            phone=user.get("phone"),
-            is_active=user.get("is_active", True),
-            picture=user.get("picture"),
-            assigned_careers=user.get("assigned_careers", []),
-            created_at=created_at
-        ))
-    return result
+    # _id order keeps the previous (insertion) ordering and is always indexed
+    skip, limit = max(0, skip), max(1, min(limit, 1000))
+    users = await _list_users({}, {"_id": 1}, skip, limit)
+    return _user_list_response(users)
 
 
 @router.get("/agents", response_model=List[UserResponse])
-async def get_agents(request: Request):
+async def get_agents(request: Request, skip: int = 0, limit: int = 1000):
     await get_current_user(request)
     
-    users = await db.users.find(
-        {"role": "agente", "is_active": True},
-        {"_id": 0, "password_hash": 0}
-    ).to_list(1000)
-    
-    result = []
-    for user in users:
-        created_at = user.get("created_at")
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        result.append(UserResponse(
-            user_id=user["user_id"],
-            email=user["email"],
-            name=user["name"],
-            role=user["role"],
-            phone=user.get("phone"),
-            is_active=user.get("is_active", True),
-            picture=user.get("picture"),
-            assigned_careers=user.get("assigned_careers", []),
-            created_at=created_at
-        ))
-    return result
+    skip, limit = max(0, skip), max(1, min(limit, 1000))
+    users = await _list_users({"role": "agente", "is_active": True}, {"_id": 1}, skip, limit)
+    return _user_list_response(users)
 
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(user_id: str, request: Request):
     await require_roles(["admin", "gerente"])(request)
     
-    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
+    user = await db.users.find_one({"user_id": user_id}, _USER_RESPONSE_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
-    created_at = user.get("created_at")
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at)
-    
-    return UserResponse(
-        user_id=user["user_id"],
-        email=user["email"],
-        name=user["name"],
-        role=user["role"],
-        phone=user.get("phone"),
-        is_active=user.get("is_active", True),
-        picture=user.get("picture"),
-        assigned_careers=user.get("assigned_careers", []),
-        created_at=created_at
-    )
+    return UserResponse.model_validate(user)
 
 
 @router.post("", response_model=UserResponse)
 async def create_user(user_data: UserCreate, request: Request):
     await require_roles(["admin"])(request)
     
-    # Check if email already exists
-    existing = await db.users.find_one({"email": user_data.email}, {"_id": 0})
-    if existing:
-        raise HTTPException(status_code=400, detail="El email ya está registrado")
-    
     user_id = f"user_{uuid.uuid4().hex[:12]}"
-    now = datetime.now(timezone.utc).isoformat()
+    now = datetime.now(timezone.utc)
     
     user_doc = {
         "user_id": user_id,
         "email": user_data.email,
         "name": user_data.name,
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await asyncio.to_thread(hash_password, user_data.password),
         "role": user_data.role,
         "phone": user_data.phone,
         "is_active": True,
@@ -113,7 +110,11 @@ async def create_user(user_data: UserCreate, request: Request):
         "created_at": now
     }
     
-    await db.users.insert_one(user_doc)
+    # The unique email index rejects duplicates atomically
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="El email ya está registrado")
     
     return UserResponse(
         user_id=user_id,
@@ -124,7 +125,7 @@ async def create_user(user_data: UserCreate, request: Request):
         is_active=True,
         picture=None,
         assigned_careers=user_data.assigned_careers,
-        created_at=datetime.fromisoformat(now)
+        created_at=now
     )
 
 
@@ -140,32 +141,21 @@ async def update_user(user_id: str, update_data: UserUpdate, request: Request):
     if not update_dict:
         raise HTTPException(status_code=400, detail="Nada que actualizar")
     
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
-    result = await db.users.update_one(
+    user = await db.users.find_one_and_update(
         {"user_id": user_id},
-        {"$set": update_dict}
+        {"$set": update_dict},
+        projection=_USER_RESPONSE_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    invalidate_agent_name(user_id)
+    invalidate_cached_user(user_id)
     
-    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
-    created_at = user.get("created_at")
-    if isinstance(created_at, str):
-        created_at = datetime.fromisoformat(created_at)
-    
-    return UserResponse(
-        user_id=user["user_id"],
-        email=user["email"],
-        name=user["name"],
-        role=user["role"],
-        phone=user.get("phone"),
-        is_active=user.get("is_active", True),
-        picture=user.get("picture"),
-        assigned_careers=user.get("assigned_careers", []),
-        created_at=created_at
-    )
+    return UserResponse.model_validate(user)
 
 
 @router.delete("/{user_id}")
@@ -175,6 +165,8 @@ async def delete_user(user_id: str, request: Request):
     result = await db.users.delete_one({"user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    invalidate_agent_name(user_id)
+    invalidate_cached_user(user_id)
     
     return {"message": "Usuario eliminado"}
 
@@ -188,17 +180,13 @@ async def admin_reset_password(user_id: str, request_data: AdminResetPasswordReq
     if current_user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Solo administradores pueden resetear contraseñas")
     
-    # Validate password
-    if len(request_data.new_password) < 6:
-        raise HTTPException(status_code=400, detail="La contraseña debe tener al menos 6 caracteres")
-    
     # Check user exists
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
     
     # Update password
-    new_hash = hash_password(request_data.new_password)
+    new_hash = await asyncio.to_thread(hash_password, request_data.new_password)
     await db.users.update_one(
         {"user_id": user_id},
         {"$set": {"password_hash": new_hash}}
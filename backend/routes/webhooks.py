@@ -2,20 +2,25 @@
 import uuid
 import secrets
 from fastapi import APIRouter, HTTPException, Request
-from typing import List
+from typing import List, Optional
 from datetime import datetime, timezone
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger
+from config import db, logger
 from models.webhooks import (
     WebhookCreate, WebhookResponse,
     NotificationSettingsUpdate, NotificationSettingsResponse,
     N8NLeadPayload
 )
 from utils.auth import get_current_user, require_roles
-from utils.helpers import find_agent_for_career, send_notification
+from utils.helpers import (
+    find_agent_for_career, find_agents_for_careers, send_notification, run_in_background, lead_search_fields,
+    get_notification_settings_cached, invalidate_notification_settings
+)
 
 router = APIRouter(tags=["webhooks"])
 
+MAX_N8N_BATCH_SIZE = 500
+
 
 @router.post("/webhooks", response_model=WebhookResponse)
 async def create_webhook(webhook_data: WebhookCreate, request: Request):
@@ -32,7 +37,7 @@ async def create_webhook(webhook_data: WebhookCreate, request: Request):
         "events": webhook_data.events,
         "is_active": webhook_data.is_active,
         "secret_key": secret_key,
-        "created_at": now.isoformat()
+        "created_at": now
     }
     
     await db.webhooks.insert_one(webhook)
@@ -50,17 +55,14 @@ async def create_webhook(webhook_data: WebhookCreate, request: Request):
 
 
 @router.get("/webhooks", response_model=List[WebhookResponse])
-async def get_webhooks(request: Request):
+async def get_webhooks(request: Request, skip: int = 0, limit: int = 100):
     await require_roles(["admin", "gerente"])(request)
     
-    webhooks = await db.webhooks.find({}, {"_id": 0}).to_list(100)
+    skip, limit = max(0, skip), max(1, min(limit, 100))
+    webhooks = await db.webhooks.find({}, {"_id": 0}).sort("_id", 1).skip(skip).limit(limit).to_list(limit)
     
     result = []
     for wh in webhooks:
-        created_at = wh.get("created_at")
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        
         result.append(WebhookResponse(
             webhook_id=wh["webhook_id"],
             name=wh["name"],
@@ -68,7 +70,7 @@ async def get_webhooks(request: Request):
             events=wh["events"],
             is_active=wh["is_active"],
             secret_key=wh["secret_key"],
-            created_at=created_at
+            created_at=wh.get("created_at")
         ))
     
     return result
@@ -85,15 +87,9 @@ async def delete_webhook(webhook_id: str, request: Request):
     return {"message": "Webhook eliminado"}
 
 
-# N8N Webhook endpoint for receiving leads
-@router.post("/webhook/n8n/lead")
-async def receive_n8n_lead(payload: N8NLeadPayload):
-    """Receive lead from N8N webhook"""
+def _build_n8n_lead(payload: N8NLeadPayload, career_agent: Optional[dict], now: datetime) -> tuple:
+    """Build the lead document, agent data and notification payload for an N8N lead"""
     lead_id = f"lead_{uuid.uuid4().hex[:12]}"
-    now = datetime.now(timezone.utc).isoformat()
-    
-    # Try to find an agent for this career
-    career_agent = await find_agent_for_career(payload.career_interest)
     assigned_agent_id = career_agent["user_id"] if career_agent else None
     
     lead_doc = {
@@ -111,16 +107,14 @@ async def receive_n8n_lead(payload: N8NLeadPayload):
         "updated_at": now,
         "created_by": "n8n_webhook"
     }
-    
-    await db.leads.insert_one(lead_doc)
+    lead_doc.update(lead_search_fields(lead_doc))
     
     # Get agent data for notification
     agent_data = None
-    if assigned_agent_id and career_agent:
+    if career_agent:
         agent_data = {"name": career_agent["name"], "email": career_agent.get("email"), "phone": career_agent.get("phone")}
     
-    # Send notification
-    await send_notification("lead.created", {
+    notification = {
         "lead_id": lead_id,
         "full_name": payload.full_name,
         "email": payload.email,
@@ -128,7 +122,23 @@ async def receive_n8n_lead(payload: N8NLeadPayload):
         "career_interest": payload.career_interest,
         "source": payload.source,
         "source_detail": payload.source_detail
-    }, agent_data)
+    }
+    return lead_doc, agent_data, notification
+
+
+# N8N Webhook endpoint for receiving leads
+@router.post("/webhook/n8n/lead")
+async def receive_n8n_lead(payload: N8NLeadPayload):
+    """Receive lead from N8N webhook"""
+    # Try to find an agent for this career
+    career_agent = await find_agent_for_career(payload.career_interest)
+    lead_doc, agent_data, notification = _build_n8n_lead(payload, career_agent, datetime.now(timezone.utc))
+    lead_id = lead_doc["lead_id"]
+    
+    await db.leads.insert_one(lead_doc)
+    
+    # Notify after responding; N8N only needs to know the lead was stored
+    run_in_background(send_notification("lead.created", notification, agent_data))
     
     logger.info(f"Lead created from N8N webhook: {lead_id}")
     
@@ -140,12 +150,40 @@ async def receive_n8n_lead(payload: N8NLeadPayload):
     }
 
 
+@router.post("/webhook/n8n/leads")
+async def receive_n8n_leads(payloads: List[N8NLeadPayload]):
+    """Receive a batch of leads from N8N in a single insert"""
+    if not payloads:
+        raise HTTPException(status_code=400, detail="No se recibieron leads")
+    if len(payloads) > MAX_N8N_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_N8N_BATCH_SIZE} leads por lote")
+    
+    now = datetime.now(timezone.utc)
+    career_agents = await find_agents_for_careers([p.career_interest for p in payloads])
+    built = [_build_n8n_lead(p, agent, now) for p, agent in zip(payloads, career_agents)]
+    
+    # Unordered: one bad document does not stop the rest of the batch
+    await db.leads.insert_many([lead_doc for lead_doc, _, _ in built], ordered=False)
+    
+    # Notifications go out concurrently after responding
+    for _, agent_data, notification in built:
+        run_in_background(send_notification("lead.created", notification, agent_data))
+    
+    logger.info(f"{len(built)} leads created from N8N webhook batch")
+    
+    return {
+        "success": True,
+        "lead_ids": [lead_doc["lead_id"] for lead_doc, _, _ in built],
+        "message": f"{len(built)} leads creados exitosamente"
+    }
+
+
 # Notification Settings
 @router.get("/settings/notifications", response_model=NotificationSettingsResponse)
 async def get_notification_settings(request: Request):
     await require_roles(["admin", "gerente"])(request)
     
-    settings = await db.notification_settings.find_one({}, {"_id": 0})
+    settings = await get_notification_settings_cached()
     
     if not settings:
         # Create default settings
@@ -156,14 +194,11 @@ async def get_notification_settings(request: Request):
             "notify_on_new_lead": True,
             "notify_on_appointment": True,
             "notify_supervisors": False,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }
         await db.notification_settings.insert_one(settings)
         settings.pop("_id", None)
-    
-    updated_at = settings.get("updated_at")
-    if isinstance(updated_at, str):
-        updated_at = datetime.fromisoformat(updated_at)
+        invalidate_notification_settings()
     
     return NotificationSettingsResponse(
         settings_id=settings["settings_id"],
@@ -172,7 +207,7 @@ async def get_notification_settings(request: Request):
         notify_on_new_lead=settings.get("notify_on_new_lead", True),
         notify_on_appointment=settings.get("notify_on_appointment", True),
         notify_supervisors=settings.get("notify_supervisors", False),
-        updated_at=updated_at
+        updated_at=settings.get("updated_at")
     )
 
 
@@ -185,13 +220,14 @@ async def update_notification_settings(settings_data: NotificationSettingsUpdate
     existing = await db.notification_settings.find_one({}, {"_id": 0})
     
     update_data = settings_data.model_dump()
-    update_data["updated_at"] = now.isoformat()
+    update_data["updated_at"] = now
     
     if existing:
         await db.notification_settings.update_one({}, {"$set": update_data})
     else:
         update_data["settings_id"] = f"settings_{uuid.uuid4().hex[:8]}"
         await db.notification_settings.insert_one(update_data)
+    invalidate_notification_settings()
     
     settings = await db.notification_settings.find_one({}, {"_id": 0})
     
@@ -2,17 +2,23 @@
 UCIC API Server - Modular Architecture
 Main entry point for the FastAPI application
 """
+import asyncio
 from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
-from config import db, logger
+from config import (
+    client, db, logger, http_client, ensure_indexes, ensure_storage_dirs, migrate_legacy_dates,
+    backfill_lead_search_fields, DEFAULT_CAREERS
+)
 
 # Import the main API router with all routes included
 from routes import api_router
+from routes.dashboard import dashboard_snapshot_loop
+from utils.helpers import drain_background_tasks
 
-# Create the main app
-app = FastAPI(title="UCIC API")
+# Create the main app (orjson serializes responses, including datetimes, natively)
+app = FastAPI(title="UCIC API", default_response_class=ORJSONResponse)
 
 # CORS Middleware
 app.add_middleware(
@@ -46,43 +52,51 @@ async def health_check():
 async def startup_event():
     logger.info("Starting UCIC API...")
     
+    # Force server selection so the connection pool starts filling before the first request
+    try:
+        await db.command("ping")
+        logger.info(f"MongoDB topology: {client.topology_description}")
+    except Exception as e:
+        logger.warning(f"MongoDB ping failed: {e}")
+    
+    await asyncio.to_thread(ensure_storage_dirs)
+    
     # Create indexes for better performance
     try:
-        await db.users.create_index("email", unique=True)
-        await db.users.create_index("user_id", unique=True)
-        await db.leads.create_index("lead_id", unique=True)
-        await db.leads.create_index("email")
-        await db.leads.create_index("assigned_agent_id")
-        await db.leads.create_index("status")
-        await db.students.create_index("student_id", unique=True)
-        await db.students.create_index("email")
-        await db.students.create_index("institutional_email", unique=True, sparse=True)
-        await db.teachers.create_index("teacher_id", unique=True)
-        await db.teachers.create_index("email", unique=True)
-        await db.careers_full.create_index("career_id", unique=True)
-        await db.appointments.create_index("appointment_id", unique=True)
-        await db.appointments.create_index("scheduled_at")
-        await db.custom_fields.create_index("field_id", unique=True)
-        await db.change_requests.create_index("request_id", unique=True)
-        await db.audit_logs.create_index("timestamp")
-        await db.audit_logs.create_index("entity_id")
+        await ensure_indexes()
         logger.info("Database indexes created/verified")
     except Exception as e:
         logger.warning(f"Index creation warning: {e}")
     
+    try:
+        await migrate_legacy_dates()
+    except Exception as e:
+        logger.warning(f"Legacy date migration warning: {e}")
+    
+    try:
+        await backfill_lead_search_fields()
+    except Exception as e:
+        logger.warning(f"Lead search field backfill warning: {e}")
+    
     # Ensure default settings exist
     careers_doc = await db.settings.find_one({"type": "careers"}, {"_id": 0})
     if not careers_doc:
-        from config import DEFAULT_CAREERS
         await db.settings.insert_one({
             "type": "careers",
             "items": DEFAULT_CAREERS
         })
         logger.info("Default careers initialized")
     
+    # Keeps the admin/gerente dashboard stats precomputed
+    app.state.dashboard_snapshot_task = asyncio.create_task(dashboard_snapshot_loop())
+    
     logger.info("UCIC API started successfully!")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down UCIC API...")
+    app.state.dashboard_snapshot_task.cancel()
+    await drain_background_tasks()
+    await http_client.aclose()
+    await client.close()
@@ -1,6 +1,12 @@
 """Utility functions"""
 from .auth import (
-    hash_password, verify_password, create_jwt_token, decode_jwt_token,
-    get_current_user, require_roles
+    hash_password, verify_password, hash_token, token_matches, create_jwt_token, decode_jwt_token,
+    get_current_user, require_roles, invalidate_session, invalidate_cached_user
+)
+from .helpers import (
+    find_agent_for_career, find_agents_for_careers, build_audit_log, create_audit_log, schedule_audit_log, send_notification,
+    parse_dt, lead_search_fields, generate_institutional_email, insert_student, run_in_background, drain_background_tasks,
+    get_lead_name, get_agent_name, invalidate_lead_name, invalidate_agent_name,
+    get_career_options_cached, invalidate_career_options,
+    get_notification_settings_cached, invalidate_notification_settings
 )
-from .helpers import find_agent_for_career, create_audit_log, send_notification
@@ -1,11 +1,14 @@
 """Authentication utilities"""
+import hashlib
+import hmac
 import bcrypt
 import jwt
+from cachetools import TTLCache
 from fastapi import HTTPException, Request
-from typing import List
+from typing import List, Optional
 from datetime import datetime, timezone, timedelta
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, JWT_SECRET, JWT_ALGORITHM, JWT_EXPIRATION_HOURS
+from config import db, JWT_SECRET, JWT_ALGORITHM, JWT_EXPIRATION_HOURS
 
 
 def hash_password(password: str) -> str:
@@ -16,6 +19,15 @@ def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 
+def hash_token(token: str) -> str:
+    """SHA-256 digest of a one-time token; only the digest is stored"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def token_matches(stored_hash: str, token_hash: str) -> bool:
+    return hmac.compare_digest(stored_hash, token_hash)
+
+
 def create_jwt_token(user_id: str, email: str, role: str) -> str:
     payload = {
         "user_id": user_id,
@@ -37,44 +49,70 @@ def decode_jwt_token(token: str) -> dict:
         raise HTTPException(status_code=401, detail="Token inválido")
 
 
+# Hot-path caches for get_current_user: session token -> user_id and
+# user_id -> user document. Logout and the user write routes invalidate them.
+_session_cache = TTLCache(maxsize=10000, ttl=60)
+_user_cache = TTLCache(maxsize=10000, ttl=60)
+
+
+def invalidate_session(session_token: str):
+    _session_cache.pop(session_token, None)
+
+
+def invalidate_cached_user(user_id: str):
+    _user_cache.pop(user_id, None)
+
+
+async def _load_user(user_id: str) -> Optional[dict]:
+    user = _user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        if user:
+            _user_cache[user_id] = user
+    return user
+
+
 async def get_current_user(request: Request) -> dict:
+    # Resolved once per request; later calls (e.g. via require_roles) reuse it
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
+    
     # Check cookie first (Google Auth)
     session_token = request.cookies.get("session_token")
     if session_token:
-        session = await db.user_sessions.find_one(
-            {"session_token": session_token},
-            {"_id": 0}
-        )
-        if session:
-            expires_at = session.get("expires_at")
-            if isinstance(expires_at, str):
-                expires_at = datetime.fromisoformat(expires_at)
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-            if expires_at > datetime.now(timezone.utc):
-                user = await db.users.find_one(
-                    {"user_id": session["user_id"]},
-                    {"_id": 0}
-                )
-                if user:
-                    return user
+        user_id = _session_cache.get(session_token)
+        if user_id is None:
+            # Expired sessions are removed by a TTL index, but the sweep runs only
+            # about once a minute, so the expiry is still part of the query
+            session = await db.user_sessions.find_one(
+                {"session_token": session_token, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+                {"_id": 0, "user_id": 1}
+            )
+            if session:
+                user_id = _session_cache[session_token] = session["user_id"]
+        if user_id:
+            user = await _load_user(user_id)
+            if user:
+                request.state.user = user
+                return user
     
     # Check Authorization header (JWT)
     auth_header = request.headers.get("Authorization")
     if auth_header and auth_header.startswith("Bearer "):
         token = auth_header.split(" ")[1]
         payload = decode_jwt_token(token)
-        user = await db.users.find_one(
-            {"user_id": payload["user_id"]},
-            {"_id": 0}
-        )
+        user = await _load_user(payload["user_id"])
         if user:
+            request.state.user = user
             return user
     
     raise HTTPException(status_code=401, detail="No autenticado")
 
 
 def require_roles(allowed_roles: List[str]):
+    allowed_roles = frozenset(allowed_roles)
+    
     async def role_checker(request: Request):
         user = await get_current_user(request)
         if user["role"] not in allowed_roles:
@@ -1,38 +1,228 @@
 """Helper utilities"""
+import re
+import unicodedata
 import uuid
+import asyncio
 import httpx
-from typing import Optional
+from cachetools import TTLCache
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional
 from datetime import datetime, timezone
-from fastapi import Request
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
-import sys; sys.path.insert(0, "/app/backend"); from config import db, logger, twilio_client, TWILIO_WHATSAPP_NUMBER
+from config import db, logger, http_client, get_twilio_client, TWILIO_WHATSAPP_NUMBER
 
+def parse_dt(value):
+    """Return a stored timestamp as a datetime; legacy ISO strings (with "+00:00" or a
+    trailing "Z") go through the C-implemented datetime.fromisoformat"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
 
-async def find_agent_for_career(career: str) -> Optional[dict]:
-    """Find an available agent assigned to handle the given career"""
-    # Find agents with this career assigned, ordered by lead count (load balancing)
+
+_NONALNUM_DOT = re.compile(r"[^a-z0-9.]")
+
+
+@lru_cache(maxsize=4096)
+def _email_base(name: str) -> str:
+    """Local part of the institutional email for an already lower-cased, stripped name"""
+    parts = name.split()
+    if len(parts) >= 2:
+        email_base = f"{parts[0]}.{parts[-1]}"
+    else:
+        email_base = parts[0] if parts else "estudiante"
+    
+    # Remove accents and special characters
+    email_base = unicodedata.normalize('NFKD', email_base).encode('ASCII', 'ignore').decode()
+    return _NONALNUM_DOT.sub('', email_base)
+
+
+def generate_institutional_email(full_name: str) -> str:
+    """Generate an institutional email from student name"""
+    return f"{_email_base(full_name.lower().strip())}@ucic.edu.mx"
+
+
+async def insert_student(student: dict, generated_email: bool):
+    """Insert a student document, resolving institutional email collisions.
+
+    The unique institutional_email index rejects duplicates; a generated address
+    then takes the next suffix from an atomic per-base counter and retries, while
+    an explicitly chosen one is rejected with a 400
+    """
+    base_email = student["institutional_email"].replace("@ucic.edu.mx", "")
+    while True:
+        try:
+            await db.students.insert_one(student)
+            break
+        except DuplicateKeyError as e:
+            if "institutional_email" not in (e.details or {}).get("keyPattern", {}):
+                raise
+            if not generated_email:
+                raise HTTPException(status_code=400, detail="El email institucional ya está en uso")
+            counter = await db.email_counters.find_one_and_update(
+                {"_id": base_email},
+                {"$inc": {"seq": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            student["institutional_email"] = f"{base_email}{counter['seq']}@ucic.edu.mx"
+            student.pop("_id", None)
+    student.pop("_id", None)
+
+
+def lead_search_fields(lead: dict) -> dict:
+    """Lower-cased copies of the searchable lead fields (prefix-matched by get_leads)"""
+    fields = {}
+    if lead.get("full_name") is not None:
+        fields["full_name_lc"] = lead["full_name"].lower()
+    if lead.get("email") is not None:
+        fields["email_lc"] = lead["email"].lower()
+    return fields
+
+
+# Strong references to in-flight background tasks so they aren't garbage collected mid-run
+_background_tasks = set()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """Schedule a coroutine without awaiting it (e.g. notifications off the request path)"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def drain_background_tasks():
+    """Wait for pending background tasks, used on shutdown so they aren't dropped"""
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+
+# Short-lived display-name caches for lead_id / user_id lookups; the lead and
+# user write routes invalidate their entries so renames show up immediately
+_lead_name_cache = TTLCache(maxsize=1024, ttl=60)
+_agent_name_cache = TTLCache(maxsize=1024, ttl=60)
+_name_lookups = {}
+
+
+async def _cached_name(cache: TTLCache, collection, key_field: str, name_field: str, key: str) -> Optional[str]:
+    if key in cache:
+        return cache[key]
+    # Concurrent misses for the same key share a single query
+    lookup_key = (collection.name, key)
+    lookup = _name_lookups.get(lookup_key)
+    if lookup is None:
+        lookup = asyncio.ensure_future(collection.find_one({key_field: key}, {"_id": 0, name_field: 1}))
+        _name_lookups[lookup_key] = lookup
+        lookup.add_done_callback(lambda _: _name_lookups.pop(lookup_key, None))
+    doc = await asyncio.shield(lookup)
+    name = doc.get(name_field) if doc else None
+    cache[key] = name
+    return name
+
+
+async def get_lead_name(lead_id: str) -> Optional[str]:
+    """Return a lead's full name (cached for a short time)"""
+    return await _cached_name(_lead_name_cache, db.leads, "lead_id", "full_name", lead_id)
+
+
+async def get_agent_name(user_id: str) -> Optional[str]:
+    """Return a user's display name (cached for a short time)"""
+    return await _cached_name(_agent_name_cache, db.users, "user_id", "name", user_id)
+
+
+def invalidate_lead_name(lead_id: str):
+    _lead_name_cache.pop(lead_id, None)
+
+
+def invalidate_agent_name(user_id: str):
+    _agent_name_cache.pop(user_id, None)
+
+
+# Career dropdown lists (dashboard and careers routes); career writes clear it
+_career_options_cache = TTLCache(maxsize=8, ttl=60)
+
+
+async def get_career_options_cached(key: str, loader: Callable[[], Awaitable[List[str]]]) -> List[str]:
+    """Return the career names stored under key, calling loader on a miss"""
+    names = _career_options_cache.get(key)
+    if names is None:
+        names = await loader()
+        _career_options_cache[key] = names
+    return names
+
+
+def invalidate_career_options():
+    _career_options_cache.clear()
+
+
+# Global notification settings singleton; rarely written, read on every notification
+_notification_settings_cache = TTLCache(maxsize=1, ttl=30)
+
+
+async def get_notification_settings_cached() -> Optional[dict]:
+    """Return the notification settings document (None if never saved)"""
+    try:
+        return _notification_settings_cache["settings"]
+    except KeyError:
+        settings = await db.notification_settings.find_one({}, {"_id": 0})
+        _notification_settings_cache["settings"] = settings
+        return settings
+
+
+def invalidate_notification_settings():
+    _notification_settings_cache.clear()
+
+
+async def _agent_lead_counts(career: str) -> List[list]:
+    """Return [agent, lead_count] pairs for the active agents assigned to career"""
     agents = await db.users.find({
         "role": "agente",
         "is_active": True,
         "assigned_careers": career
     }, {"_id": 0}).to_list(100)
     
-    if not agents:
+    lead_counts = await asyncio.gather(*(
+        db.leads.count_documents({"assigned_agent_id": agent["user_id"]}) for agent in agents
+    ))
+    return [[agent, count] for agent, count in zip(agents, lead_counts)]
+
+
+async def find_agent_for_career(career: str) -> Optional[dict]:
+    """Find an available agent assigned to handle the given career"""
+    agent_lead_counts = await _agent_lead_counts(career)
+    if not agent_lead_counts:
         # If no agent has this career, return None (will use default assignment)
         return None
     
-    # Simple load balancing: count leads per agent and assign to the one with fewer leads
-    agent_lead_counts = []
-    for agent in agents:
-        lead_count = await db.leads.count_documents({"assigned_agent_id": agent["user_id"]})
-        agent_lead_counts.append((agent, lead_count))
+    # Simple load balancing: assign to the agent with fewer leads
+    return min(agent_lead_counts, key=lambda x: x[1])[0]
+
+
+async def find_agents_for_careers(careers: List[str]) -> List[Optional[dict]]:
+    """Find an agent for each career in a batch, balancing load within the batch"""
+    unique_careers = list(dict.fromkeys(careers))
+    counts_by_career = dict(zip(
+        unique_careers,
+        await asyncio.gather(*(_agent_lead_counts(career) for career in unique_careers))
+    ))
     
-    # Sort by lead count (ascending) and return the agent with fewer leads
-    agent_lead_counts.sort(key=lambda x: x[1])
-    return agent_lead_counts[0][0] if agent_lead_counts else None
+    assigned = []
+    for career in careers:
+        agent_lead_counts = counts_by_career[career]
+        if not agent_lead_counts:
+            assigned.append(None)
+            continue
+        # Count the leads handed out earlier in this batch as well
+        pair = min(agent_lead_counts, key=lambda x: x[1])
+        pair[1] += 1
+        assigned.append(pair[0])
+    return assigned
 
 
-async def create_audit_log(
+def build_audit_log(
     entity_type: str,
     entity_id: str,
     action: str,
@@ -42,8 +232,8 @@ async def create_audit_log(
     old_value=None,
     new_value=None,
     authorized_by: Optional[dict] = None
-):
-    """Create an audit log entry"""
+) -> dict:
+    """Build an audit log entry without saving it (for batched inserts)"""
     log_id = f"log_{uuid.uuid4().hex[:12]}"
     
     # Get client IP
@@ -65,19 +255,44 @@ async def create_audit_log(
         "performed_by_role": performed_by["role"],
         "authorized_by_id": authorized_by["user_id"] if authorized_by else None,
         "authorized_by_name": authorized_by["name"] if authorized_by else None,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "ip_address": ip_address
     }
-    
+    return log_entry
+
+
+async def create_audit_log(
+    entity_type: str,
+    entity_id: str,
+    action: str,
+    performed_by: dict,
+    request: Request,
+    field_changed: Optional[str] = None,
+    old_value=None,
+    new_value=None,
+    authorized_by: Optional[dict] = None
+):
+    """Create an audit log entry"""
+    log_entry = build_audit_log(
+        entity_type, entity_id, action, performed_by, request,
+        field_changed=field_changed, old_value=old_value, new_value=new_value, authorized_by=authorized_by
+    )
     await db.audit_logs.insert_one(log_entry)
     return log_entry
 
 
+def schedule_audit_log(*args, **kwargs) -> dict:
+    """Build an audit log entry now and insert it in the background (non-critical audits)"""
+    log_entry = build_audit_log(*args, **kwargs)
+    run_in_background(db.audit_logs.insert_one(log_entry))
+    return log_entry
+
+
 async def send_notification(event: str, data: dict, agent_data: Optional[dict] = None):
     """Send notification via webhook and optionally WhatsApp"""
     try:
         # Get notification settings
-        settings = await db.notification_settings.find_one({}, {"_id": 0})
+        settings = await get_notification_settings_cached()
         
         if not settings:
             logger.info("No notification settings configured")
@@ -96,9 +311,8 @@ async def send_notification(event: str, data: dict, agent_data: Optional[dict] =
                     payload["assigned_agent"] = agent_data
                 
                 logger.info(f"Sending webhook to: {webhook_url}")
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(webhook_url, json=payload, timeout=5.0)
-                    logger.info(f"Webhook notification sent: {response.status_code} - {response.text[:100] if response.text else 'No response body'}")
+                response = await http_client.post(webhook_url, json=payload, timeout=5.0)
+                logger.info(f"Webhook notification sent: {response.status_code} - {response.text[:100] if response.text else 'No response body'}")
             except httpx.TimeoutException:
                 logger.error(f"Webhook timeout - server not responding: {webhook_url}")
             except httpx.ConnectError as e:
@@ -108,6 +322,7 @@ async def send_notification(event: str, data: dict, agent_data: Optional[dict] =
         
         # Send WhatsApp notification if configured
         notification_phone = settings.get("notification_phone")
+        twilio_client = get_twilio_client() if notification_phone else None
         if notification_phone and twilio_client and settings.get("notify_on_new_lead", True):
             try:
                 if event == "lead.created":
@@ -0,0 +1,65 @@
+"""Tests for the cached custom field definitions in routes.students"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+from routes import students  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.find_calls = 0
+
+    def find(self, query, projection):
+        self.find_calls += 1
+        return FakeCursor(list(self.docs))
+
+
+class FakeDB:
+    def __init__(self, custom_fields):
+        self.custom_fields = FakeCollection(custom_fields)
+
+
+def test_get_custom_fields_with_empty_cache(monkeypatch):
+    fake_db = FakeDB([
+        {"field_id": "field_b", "name": "B", "order": 2},
+        {"field_id": "field_a", "name": "A", "order": 1},
+    ])
+    monkeypatch.setattr(students, "db", fake_db)
+
+    async def fake_current_user(request):
+        return {"user_id": "user_test", "role": "admin"}
+
+    monkeypatch.setattr(students, "get_current_user", fake_current_user)
+    students.invalidate_custom_fields()
+
+    response = asyncio.run(students.get_custom_fields(request=None))
+
+    assert response.status_code == 200
+    assert b'"field_a"' in response.body
+    assert response.body.index(b'"field_a"') < response.body.index(b'"field_b"')
+    assert fake_db.custom_fields.find_calls == 1
+
+    # A second read is served from the cache
+    asyncio.run(students.get_custom_fields_cached())
+    assert fake_db.custom_fields.find_calls == 1
+    students.invalidate_custom_fields()